@@ -26,7 +26,8 @@ setup(
     license="LGPL",
     zip_safe=True,
     packages=["template2pdf", "template2pdf.t2p", "template2pdf.dj",
-              "template2pdf/dj/templatetags", "template2pdf.kfw",],
+              "template2pdf/dj/templatetags", "template2pdf.dj.management",
+              "template2pdf.dj.management.commands", "template2pdf.kfw",],
     data_files=([[dirname, glob.glob(dirname+'/*')]
                  for dirname in ["template2pdf/dj/templates",
                                  "template2pdf/dj/resources",
@@ -0,0 +1,299 @@
+# coding: utf-8
+
+# Copyright (c) 2010, 2011 Accense Technology, Inc. All rights reserved.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Coalescing of identical renders running at the same time.
+
+A render is identified by a fingerprint of what it depends on (template
+name and params). While one is in flight, callers asking for the same
+fingerprint wait for it and share its result instead of rendering again.
+"""
+import datetime
+import decimal
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+import warnings
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# types whose repr tells their values apart
+SCALAR_TYPES = (basestring, int, long, float, bool, type(None),
+                decimal.Decimal, datetime.date, datetime.time,
+                datetime.timedelta)
+
+
+def _canonical(value):
+    if isinstance(value, SCALAR_TYPES):
+        return value
+    if isinstance(value, dict):
+        return tuple(sorted([(_canonical(k), _canonical(v))
+                             for k, v in value.items()]))
+    if isinstance(value, (list, tuple)):
+        return tuple([_canonical(item) for item in value])
+    if callable(value):
+        return None
+    raise TypeError('can not fingerprint %s value; pass a key instead'
+                    %(type(value).__name__))
+
+
+def fingerprint(*parts):
+    """Fingerprint of parts, made of strings, numbers, dates, dicts and
+    sequences; callables (e.g. helper functions in template params) are
+    left out. Values of other types (e.g. model instances, whose repr may
+    not tell them apart) raise TypeError.
+
+    >>> fingerprint('a.rml', dict(a=[1, 2], b=u'x'))==fingerprint(
+    ...     'a.rml', dict(b=u'x', a=(1, 2)))
+    True
+    >>> fingerprint('a.rml', dict(a=1))==fingerprint('b.rml', dict(a=1))
+    False
+    >>> fingerprint('a.rml', dict(a=object()))
+    Traceback (most recent call last):
+    ...
+    TypeError: can not fingerprint object value; pass a key instead
+    """
+    return hashlib.sha1(repr(_canonical(parts))).hexdigest()
+
+
+class _Call(object):
+    """Call in flight, with result or exception once done.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = self.exc_info = None
+
+
+class SingleFlight(object):
+    """Runs at most one call per key at a time in the process; callers
+    with the same key wait for the running call, and get its result (or
+    exception).
+
+    >>> import time
+    >>> flight, calls, results = SingleFlight(), [], []
+    >>> def render():
+    ...     calls.append(1)
+    ...     time.sleep(0.2)
+    ...     return 'pdf'
+    >>> threads = [threading.Thread(
+    ...     target=lambda: results.append(flight.do('key', render)))
+    ...            for i in range(5)]
+    >>> for thread in threads: thread.start()
+    >>> for thread in threads: thread.join()
+    >>> len(calls), results
+    (1, ['pdf', 'pdf', 'pdf', 'pdf', 'pdf'])
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func, *args, **kw):
+        """Call func(*args, **kw), or wait for the call running with key
+        (e.g. a fingerprint of what func depends on).
+        """
+        self.lock.acquire()
+        try:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+        finally:
+            self.lock.release()
+        if not leader:
+            call.done.wait()
+            if call.exc_info:
+                raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+            return call.result
+        try:
+            call.result = func(*args, **kw)
+        except:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            self.lock.acquire()
+            try:
+                del self.calls[key]
+            finally:
+                self.lock.release()
+            call.done.set()
+        return call.result
+
+
+class FileSingleFlight(SingleFlight):
+    """SingleFlight shared by processes of a host, through lock files in
+    directory. Results are strings (e.g. PDF), passed to waiting processes
+    through a file next to the lock. File locks need fcntl (POSIX);
+    without it, calls are only shared within the process, as SingleFlight
+    does, with a RuntimeWarning.
+
+    The process holding the lock of a key renders; others block on it,
+    then take the result, or render themselves if there is none (the
+    render failed). Threads of a process share one call, as SingleFlight.
+
+    Files of a key are left for processes waiting on it; those not used
+    for max_age seconds are removed by sweep(), which each process runs
+    once per max_age as it renders. Keys in flight are left alone.
+
+    >>> flight = FileSingleFlight(tempfile.mkdtemp())
+    >>> flight.do('key', lambda: 'pdf'), flight.do('key', lambda: 'new')
+    ('pdf', 'new')
+    >>> len(os.listdir(flight.directory))
+    2
+    >>> flight.sweep(-1)
+    >>> os.listdir(flight.directory)
+    []
+    """
+
+    def __init__(self, directory=None, max_age=3600):
+        if fcntl is None:
+            warnings.warn('file locks need fcntl (POSIX); renders are only '
+                          'shared within the process', RuntimeWarning)
+        SingleFlight.__init__(self)
+        self.directory = directory or os.path.join(
+            tempfile.gettempdir(), 't2p-coalesce')
+        self.max_age = max_age
+        self.swept = time.time()
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # made by another process meanwhile
+                pass
+
+    def do(self, key, func, *args, **kw):
+        if fcntl is None:
+            return SingleFlight.do(self, key, func, *args, **kw)
+        return SingleFlight.do(self, key, self._do, key, func, args, kw)
+
+    def _lock(self, path):
+        """Open and lock lock file path, blocking if locked; returns the
+        file and whether it had to wait.
+        """
+        while True:
+            lock = open(path, 'a')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX|fcntl.LOCK_NB)
+                waited = False
+            except IOError:
+                # in flight in another process
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                waited = True
+            try:
+                # lock file may have been swept while waiting
+                if os.fstat(lock.fileno()).st_ino==os.stat(path).st_ino:
+                    return lock, waited
+            except OSError:
+                pass
+            lock.close()
+
+    def _do(self, key, func, args, kw):
+        path = os.path.join(self.directory, fingerprint(key))
+        lock, waited = self._lock(path+'.lock')
+        try:
+            if waited:
+                if os.path.exists(path+'.out'):
+                    return open(path+'.out', 'rb').read()
+            else:
+                # result of an earlier render is not shared
+                if os.path.exists(path+'.out'):
+                    os.remove(path+'.out')
+            # marks the key as used, see sweep()
+            os.utime(path+'.lock', None)
+            result = func(*args, **kw)
+            fd, temp = tempfile.mkstemp(dir=self.directory)
+            fp = os.fdopen(fd, 'wb')
+            fp.write(result)
+            fp.close()
+            os.rename(temp, path+'.out')
+        finally:
+            lock.close()
+        if time.time()-self.swept>=self.max_age:
+            self.sweep()
+        return result
+
+    def sweep(self, max_age=None):
+        """Remove files of keys not used for max_age seconds (by default
+        self.max_age).
+
+        Files of a key are removed holding its lock, and skipped if it is
+        locked (in flight).
+
+        >>> flight = FileSingleFlight(tempfile.mkdtemp())
+        >>> flight.do('a', lambda: 'pdf'), flight.do('b', lambda: 'pdf')
+        ('pdf', 'pdf')
+        >>> held = open(os.path.join(flight.directory,
+        ...                          fingerprint('a')+'.lock'), 'a')
+        >>> fcntl.flock(held, fcntl.LOCK_EX)
+        >>> flight.sweep(-1)
+        >>> len(os.listdir(flight.directory))
+        2
+        """
+        if fcntl is None:
+            # no lock files are made
+            return
+        if max_age is None:
+            max_age = self.max_age
+        self.swept = time.time()
+        limit = self.swept-max_age
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.out') and os.path.exists(path[:-4]+'.lock'):
+                # removed along with its lock
+                continue
+            if not name.endswith('.lock'):
+                # left by a process which died while writing
+                self._remove_old(path, limit)
+                continue
+            try:
+                lock = open(path, 'a')
+            except IOError:
+                continue
+            try:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX|fcntl.LOCK_NB)
+                except IOError:
+                    continue
+                if self._remove_old(path, limit):
+                    self._remove_old(path[:-5]+'.out', None)
+            finally:
+                lock.close()
+
+    def _remove_old(self, path, limit):
+        """Remove file path if last modified before limit (any time if
+        None); returns whether it was removed.
+        """
+        try:
+            if limit is None or os.path.getmtime(path)<limit:
+                os.remove(path)
+                return True
+        except OSError:
+            # removed by another process
+            pass
+        return False
+
+
+if __name__=="__main__":
+    from doctest import testmod
+    testmod()
@@ -0,0 +1,260 @@
+# coding: utf-8
+
+# Copyright (c) 2010, 2011 Accense Technology, Inc. All rights reserved.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""HTTP conditional and range requests for PDF views.
+
+The entity tag of a PDF is computed from its RML and the files the RML
+refers to, before laying it out, so unchanged documents are answered with
+304 without rendering. Rendered PDF may be kept on disk by entity tag
+(OutputCache), serving repeated downloads and byte ranges from there.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from template2pdf.utils import find_resource_abspath
+
+# files referred to by RML (images, fonts, chart data)
+regex_file = re.compile(r'\b(?:file|fileName)="([^"]*)"')
+regex_range = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def rml_etag(rml, resource_dirs=(), *extra):
+    """Entity tag of PDF rendered from rml (a UTF-8 string), from rml,
+    size and modification time of files it refers to, found in
+    resource_dirs, and extra values (e.g. rendering options).
+
+    >>> rml_etag('<document/>')==rml_etag('<document/>')
+    True
+    >>> rml_etag('<document/>')==rml_etag('<document/>', (), 'option')
+    False
+
+    References not found (e.g. URLs) go by their text.
+
+    >>> len(rml_etag('<image file="http://example.com/a.png"/>'))
+    42
+    """
+    digest = hashlib.sha1(rml)
+    for path in sorted(set(regex_file.findall(rml))):
+        if not os.path.isabs(path):
+            try:
+                path = find_resource_abspath(path, resource_dirs)
+            except ValueError:
+                digest.update('\n%s' %(path))
+                continue
+        try:
+            stat = os.stat(path)
+            digest.update('\n%s %d %d' %(path, stat.st_size, stat.st_mtime))
+        except OSError:
+            digest.update('\n%s' %(path))
+    digest.update(repr(extra))
+    return '"%s"' %(digest.hexdigest())
+
+
+def etag_matches(header, etag):
+    """Whether If-None-Match header matches etag.
+
+    >>> etag_matches('"a", W/"b"', '"b"'), etag_matches('*', '"c"')
+    (True, True)
+    >>> etag_matches(None, '"a"'), etag_matches('"ab"', '"a"')
+    (False, False)
+    """
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return ('*' in tags or etag in tags or 'W/'+etag in tags)
+
+
+def byte_range(header, length):
+    """(start, stop) of bytes asked for by Range header, for content of
+    length bytes; None if there is no header, or if it is not a single
+    range of bytes (then whole content is sent). Raises ValueError if the
+    range is not satisfiable.
+
+    >>> byte_range('bytes=0-99', 1000), byte_range('bytes=900-', 1000)
+    ((0, 100), (900, 1000))
+    >>> byte_range('bytes=-10', 1000), byte_range('bytes=0-1,5-9', 1000)
+    ((990, 1000), None)
+    >>> byte_range('bytes=1000-', 1000)
+    Traceback (most recent call last):
+    ...
+    ValueError: range not satisfiable
+    """
+    match = header and regex_range.match(header.strip())
+    if not match or match.groups()==('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        start, stop = max(length-int(last), 0), length
+    else:
+        start = int(first)
+        stop = min(last and int(last)+1 or length, length)
+    if start>=stop:
+        raise ValueError('range not satisfiable')
+    return start, stop
+
+
+def respond(etag, if_none_match, range_header, render, cache=None,
+            if_range=None):
+    """Answer request for PDF of etag, with If-None-Match, Range and
+    If-Range headers (None if not given), as (status, content, headers).
+
+    render() renders the PDF, unless it is not needed (304) or kept in
+    cache, an OutputCache. It must give the same bytes for the same etag
+    (e.g. rml2pdf with deterministic set to etag), as clients put ranges
+    of several responses together.
+
+    >>> respond('"a"', '"a"', None, None)[:2]
+    (304, '')
+    >>> status, content, headers = respond('"a"', None, 'bytes=1-3',
+    ...                                    lambda: '%PDF-1.4')
+    >>> status, content, headers[-1]
+    (206, 'PDF', ('Content-Range', 'bytes 1-3/8'))
+
+    Range is only honoured if If-Range, when given, is etag itself (dates
+    and weak tags never match); otherwise the whole PDF is sent.
+
+    >>> respond('"a"', None, 'bytes=1-3', lambda: '%PDF-1.4', None,
+    ...         '"b"')[:2]
+    (200, '%PDF-1.4')
+    """
+    headers = [('ETag', etag), ('Accept-Ranges', 'bytes')]
+    if etag_matches(if_none_match, etag):
+        return 304, '', headers
+    if if_range and if_range.strip()!=etag:
+        range_header = None
+    pdf = None
+    length = cache and cache.size(etag)
+    if length is None:
+        pdf = render()
+        length = len(pdf)
+        if cache:
+            cache.put(etag, pdf)
+    try:
+        requested = byte_range(range_header, length)
+    except ValueError:
+        return 416, '', headers+[('Content-Range', 'bytes */%d' %(length))]
+    if requested is None:
+        status, (start, stop) = 200, (0, length)
+    else:
+        status, (start, stop) = 206, requested
+        headers.append(('Content-Range',
+                        'bytes %d-%d/%d' %(start, stop-1, length)))
+    if pdf is None:
+        content = cache.read(etag, start, stop)
+        if content is None:
+            # removed from cache meanwhile
+            content = render()[start:stop]
+    else:
+        content = pdf[start:stop]
+    return status, content, headers
+
+
+class OutputCache(object):
+    """Rendered PDF kept in directory by entity tag.
+
+    At most max_files are kept; the least recently used go first.
+
+    >>> cache = OutputCache(tempfile.mkdtemp())
+    >>> cache.get('"a"') is None
+    True
+    >>> cache.put('"a"', '%PDF-1.4')
+    >>> cache.get('"a"'), cache.read('"a"', 1, 4)
+    ('%PDF-1.4', 'PDF')
+    """
+    # extension of kept files
+    suffix = '.pdf'
+
+    def __init__(self, directory, max_files=256):
+        self.directory = directory
+        self.max_files = max_files
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # made by another process meanwhile
+                pass
+
+    def path(self, etag):
+        return os.path.join(self.directory, etag.strip('W/"')+self.suffix)
+
+    def size(self, etag):
+        """Size of PDF of etag, None if not kept.
+        """
+        try:
+            size = os.path.getsize(self.path(etag))
+        except OSError:
+            return None
+        # marks as used
+        os.utime(self.path(etag), None)
+        return size
+
+    def read(self, etag, start=0, stop=None):
+        """Bytes start to stop of PDF of etag, None if not kept.
+        """
+        try:
+            fp = open(self.path(etag), 'rb')
+        except IOError:
+            return None
+        try:
+            fp.seek(start)
+            if stop is None:
+                return fp.read()
+            return fp.read(stop-start)
+        finally:
+            fp.close()
+
+    def get(self, etag):
+        """PDF of etag, None if not kept.
+        """
+        if self.size(etag) is None:
+            return None
+        return self.read(etag)
+
+    def put(self, etag, pdf):
+        fd, temp = tempfile.mkstemp(dir=self.directory)
+        fp = os.fdopen(fd, 'wb')
+        fp.write(pdf)
+        fp.close()
+        os.rename(temp, self.path(etag))
+        self.prune()
+
+    def prune(self):
+        names = [name for name in os.listdir(self.directory)
+                 if name.endswith(self.suffix)]
+        if len(names)<=self.max_files:
+            return
+        paths = [os.path.join(self.directory, name) for name in names]
+        def mtime(path):
+            try:
+                return os.path.getmtime(path)
+            except OSError:
+                return 0
+        paths.sort(key=mtime)
+        for path in paths[:len(paths)-self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                # removed by another process
+                pass
+
+
+if __name__=="__main__":
+    from doctest import testmod
+    testmod()
@@ -19,24 +19,37 @@
 """PDF renderer, using trml2pdf, for django
 """
 import os.path
+from contextlib import contextmanager
 
 from django.conf import settings
 from django.http import HttpResponse
 from django.template import Context, RequestContext, TemplateSyntaxError
-from django.template.loader import render_to_string
+from django.template.loader import get_template, render_to_string
 from django.utils.html import escape
-from template2pdf.utils import find_resource_abspath, rml2pdf, FontResolver, ImageResolver
-
-
-# values from settings
-try:
-    FONT_DIRS = settings.T2P_FONT_DIRS
-except:
-    FONT_DIRS = []
-try:
-    RESOURCE_DIRS = settings.T2P_RESOURCE_DIRS
-except:
-    RESOURCE_DIRS = []
+from template2pdf.coalesce import fingerprint, FileSingleFlight, SingleFlight
+from template2pdf.conditional import respond, rml_etag, OutputCache
+from template2pdf.images import ImageCache, ImageProcessor
+from template2pdf.utils import find_resource_abspath, rml2pdf, rml2pdf_records, warm_up, FontResolver, ImageResolver
+
+# AppConfig for Django 1.7+, warming up at startup (see warmup)
+default_app_config = 'template2pdf.dj.apps.Template2PdfConfig'
+
+
+def get_setting(name, default):
+    """Value of Django setting name, or default if not set.
+    """
+    try:
+        return getattr(settings, name)
+    except:
+        return default
+
+
+# directories of resources and fonts, filled from settings on first use
+# (see setup_dirs), so importing does not need configured settings
+FONT_DIRS = []
+RESOURCE_DIRS = []
+_dirs_set_up = []
+
 # populate RESOURCE_DIR with 'resources' under project and application dirs
 def populate_resource_dirs(dirs=None, resource_dirname='resources'):
     if dirs==None:
@@ -45,7 +58,6 @@ def populate_resource_dirs(dirs=None, resource_dirname='resources'):
         path = os.path.join(dir_, resource_dirname)
         if (path not in RESOURCE_DIRS):
             RESOURCE_DIRS.append(path)
-populate_resource_dirs()        
 
 # populate FONT_DIRS with RESOURCE_DIRS/fonts
 def populate_font_dirs(dirs=RESOURCE_DIRS, font_dirname='fonts'):
@@ -54,35 +66,220 @@ def populate_font_dirs(dirs=RESOURCE_DIRS, font_dirname='fonts'):
         path = os.path.join(os.path.abspath(dir_), font_dirname)
         if (path not in FONT_DIRS):
             FONT_DIRS.append(path)
-populate_font_dirs()        
+
+def setup_dirs():
+    """Fills FONT_DIRS and RESOURCE_DIRS from T2P_FONT_DIRS and
+    T2P_RESOURCE_DIRS settings, and populates them, once.
+    """
+    if _dirs_set_up:
+        return
+    _dirs_set_up.append(True)
+    FONT_DIRS[:0] = get_setting('T2P_FONT_DIRS', [])
+    RESOURCE_DIRS[:0] = get_setting('T2P_RESOURCE_DIRS', [])
+    populate_resource_dirs()
+    populate_font_dirs()
+
 # font cache
 FONT_CACHE = {}
+# image cache, by path and modification time, of at most IMAGE_CACHE_SIZE
+# images (read into memory)
+IMAGE_CACHE = {}
+IMAGE_CACHE_SIZE = 64
 
-font_resolver = FontResolver(FONT_DIRS, FONT_CACHE).resolve_font
-image_resolver = ImageResolver(RESOURCE_DIRS).resolve_image
+_font_resolver = FontResolver(FONT_DIRS, FONT_CACHE)
+_image_resolver = ImageResolver(RESOURCE_DIRS, IMAGE_CACHE,
+                                image_cache_size=IMAGE_CACHE_SIZE)
 
+# coalesces identical renders in flight (see render_to_pdf), across
+# processes with T2P_COALESCE_DIR setting
+_flight = []
 
-def render_to_pdf(template_name, params, context_instance=None,
-                  font_resolver=font_resolver, image_resolver=image_resolver):
-    """Renders PDF from RML, which is rendered from a Django template.
+def get_flight():
+    if not _flight:
+        directory = get_setting('T2P_COALESCE_DIR', None)
+        _flight.append(directory and FileSingleFlight(directory)
+                       or SingleFlight())
+    return _flight[0]
+
+# PDF kept by entity tag for repeated downloads and byte ranges (see
+# direct_to_pdf), with T2P_OUTPUT_CACHE_DIR setting
+_output_cache = []
 
+def get_output_cache():
+    if not _output_cache:
+        directory = get_setting('T2P_OUTPUT_CACHE_DIR', None)
+        _output_cache.append(directory and OutputCache(
+            directory, get_setting('T2P_OUTPUT_CACHE_SIZE', 256)))
+    return _output_cache[0]
+
+def font_resolver(font_type, params):
+    setup_dirs()
+    return _font_resolver.resolve_font(font_type, params)
+
+# downsamples images to T2P_IMAGE_DPI setting at their placed size, if
+# set, keeping results in T2P_IMAGE_CACHE_DIR
+_image_processor = []
+
+def get_image_processor():
+    if not _image_processor:
+        dpi = get_setting('T2P_IMAGE_DPI', None)
+        directory = get_setting('T2P_IMAGE_CACHE_DIR', None)
+        _image_processor.append(dpi and ImageProcessor(
+            dpi, get_setting('T2P_IMAGE_QUALITY', 80),
+            get_setting('T2P_IMAGE_COLORS', 256),
+            directory and ImageCache(
+                directory, get_setting('T2P_IMAGE_CACHE_SIZE', 1024))))
+    return _image_processor[0]
+
+def image_resolver(node):
+    setup_dirs()
+    _image_resolver.processor = get_image_processor()
+    return _image_resolver.resolve_image(node)
+
+
+def warmup(templates=None, render=None, font_resolver=font_resolver,
+           image_resolver=image_resolver):
+    """Loads templates and what rendering them needs, so the first
+    requests do not: templates are compiled, fonts registered, images
+    read and shared styles built (see template2pdf.utils.warm_up).
+
+    templates defaults to T2P_WARMUP_TEMPLATES setting (names, or
+    (name, params) pairs), render (rendering each template once) to
+    T2P_WARMUP_RENDER. Returns names of templates.
+    """
+    if templates is None:
+        templates = get_setting('T2P_WARMUP_TEMPLATES', [])
+    if render is None:
+        render = get_setting('T2P_WARMUP_RENDER', False)
+    names = []
+    for template_name in templates:
+        params = {}
+        if not isinstance(template_name, basestring):
+            template_name, params = template_name
+        rml = render_to_string(template_name, params).encode('utf-8')
+        warm_up(rml, font_resolver, image_resolver, render=render)
+        names.append(template_name)
+    return names
+
+
+def render_to_chunks(template_name, params, context_instance=None):
+    """Renders a Django template into a generator of chunks, one for each
+    node of the template's top-level nodelist.
+
+    A template extending another one renders as a single chunk.
     """
     context_instance = context_instance or Context()
     context_instance.update(params)
-    rml = render_to_string(
-        template_name, params, context_instance).encode('utf-8')
+    template = get_template(template_name)
+    # backend template of Django 1.8+ wraps the compiled one
+    template = getattr(template, 'template', template)
+    context_instance.render_context.push()
     try:
-        pdf = rml2pdf(rml, font_resolver, image_resolver)
+        with _bound(context_instance, template):
+            for node in template.nodelist:
+                # render_annotated of Django 1.9+ annotates errors with source
+                yield getattr(node, 'render_annotated', node.render)(
+                    context_instance)
+    finally:
+        context_instance.render_context.pop()
+
+
+@contextmanager
+def _bound(context, template):
+    """Binds context to template while rendering its nodes, as
+    Template.render does on Django 1.8+ ({% include %} and {% extends %}
+    need it), unless it is bound already.
+    """
+    if getattr(context, 'template', True) is None:
+        with context.bind_template(template):
+            context.template_name = template.name
+            yield
+    else:
+        yield
+
+
+def render_to_pdf(template_name, params, context_instance=None,
+                  font_resolver=font_resolver, image_resolver=image_resolver,
+                  sources=None, pages=None, stream=False, coalesce=False,
+                  profile=None):
+    """Renders PDF from RML, which is rendered from a Django template.
+
+    sources maps names to Python objects the RML refers to, and pages
+    limits output to some pages, e.g. for previews (see rml2pdf).
+
+    With stream, RML is parsed chunk by chunk while the template renders
+    (see render_to_chunks), rather than from the whole of its output.
+
+    profile names output options: fast, default or small (see rml2pdf).
+
+    With coalesce, callers rendering the same template, params and pages
+    while a render of them is in flight wait for it and share its PDF
+    (see template2pdf.coalesce). Only for output depending on these
+    alone, not on context processors or sources. params must be made of
+    strings, numbers, dates, dicts and sequences; otherwise (e.g. with
+    model instances) pass as coalesce a key identifying them instead.
+    """
+    if coalesce:
+        key = coalesce is True and params or coalesce
+        return get_flight().do(
+            fingerprint(template_name, key, pages, profile), render_to_pdf,
+            template_name, params, context_instance, font_resolver,
+            image_resolver, sources, pages, stream, False, profile)
+    if stream:
+        rml = render_to_chunks(template_name, params, context_instance)
+    else:
+        context_instance = context_instance or Context()
+        context_instance.update(params)
+        rml = render_to_string(
+            template_name, params, context_instance).encode('utf-8')
+    try:
+        pdf = rml2pdf(rml, font_resolver, image_resolver, sources, pages,
+                      profile=profile)
     except Exception, e:
         rml = escape(rml)
         raise TemplateSyntaxError(str(e))
     return pdf
 
 
+def render_records_to_pdf(template_name, records,
+                          font_resolver=font_resolver,
+                          image_resolver=image_resolver, sources=None):
+    """Renders one PDF of a Django template rendered for each of records
+    (a sequence of params), with page numbers restarting per record.
+    """
+    def rmls():
+        for params in records:
+            context_instance = Context()
+            context_instance.update(params)
+            yield render_to_string(
+                template_name, params, context_instance).encode('utf-8')
+    try:
+        pdf = rml2pdf_records(rmls(), font_resolver, image_resolver, sources)
+    except Exception, e:
+        raise TemplateSyntaxError(str(e))
+    return pdf
+
+
 def direct_to_pdf(request, template_name, params=None, context_instance=None,
-                  pdf_name=None, download=True):
+                  pdf_name=None, download=True, coalesce=False,
+                  linearize=False, profile=None):
     """Simple generic view to tender rml template.
 
+    The response has an entity tag of the RML and the files it refers to,
+    computed before laying out: If-None-Match is answered with 304 without
+    rendering. PDF is rendered in deterministic mode, the entity tag
+    giving its ID, so the same tag stands for the same bytes. Range
+    requests get the bytes asked for. With T2P_OUTPUT_CACHE_DIR setting,
+    PDF is kept there by entity tag, and served from there rather than
+    rendered again.
+
+    coalesce shares renders in flight of the same entity tag, as
+    render_to_pdf does.
+
+    linearize writes linearized PDF, which viewers show from the first
+    page on while the rest downloads (see rml2pdf), and profile names
+    output options (fast, default or small).
+
     >>> from django.http import HttpRequest
     >>> resp = direct_to_pdf(HttpRequest(), 'common/base.rml')
     >>> resp['content-type'], resp['content-disposition']
@@ -100,8 +297,29 @@ def direct_to_pdf(request, template_name, params=None, context_instance=None,
         else:
             pdf_name = 'download.pdf'
     params['pdf_name'] = pdf_name
-    pdf = render_to_pdf(template_name, params, context_instance)
-    response = HttpResponse(pdf, mimetype='application/pdf')
+    context_instance.update(params)
+    rml = render_to_string(
+        template_name, params, context_instance).encode('utf-8')
+    setup_dirs()
+    etag = rml_etag(rml, RESOURCE_DIRS+FONT_DIRS, linearize, profile)
+    def render():
+        try:
+            # same bytes for the same entity tag, for ranges
+            return rml2pdf(rml, font_resolver, image_resolver,
+                           linearize=linearize, profile=profile,
+                           deterministic=etag)
+        except Exception, e:
+            raise TemplateSyntaxError(str(e))
+    if coalesce:
+        render = lambda render=render: get_flight().do(etag, render)
+    status, content, headers = respond(
+        etag, request.META.get('HTTP_IF_NONE_MATCH'),
+        request.META.get('HTTP_RANGE'), render, get_output_cache(),
+        request.META.get('HTTP_IF_RANGE'))
+    response = HttpResponse(content, content_type='application/pdf',
+                            status=status)
+    for name, value in headers:
+        response[name] = value
     if download:
         disposition = 'attachment; filename=%s' %(pdf_name)
         response['Content-Disposition'] = disposition
@@ -0,0 +1,34 @@
+# coding: utf-8
+
+# Copyright (c) 2010, 2011 Accense Technology, Inc. All rights reserved.
+# 
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Application config of template2pdf.dj (Django 1.7+)
+"""
+from django.apps import AppConfig
+
+
+class Template2PdfConfig(AppConfig):
+    """Warms up at startup if T2P_WARMUP_ON_READY is set, so that worker
+    processes serve their first requests hot.
+    """
+    name = 'template2pdf.dj'
+    verbose_name = 'template2pdf'
+
+    def ready(self):
+        from template2pdf import dj
+        if dj.get_setting('T2P_WARMUP_ON_READY', False):
+            dj.warmup()
@@ -0,0 +1,54 @@
+# coding: utf-8
+
+# Copyright (c) 2010, 2011 Accense Technology, Inc. All rights reserved.
+# 
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""./manage.py t2p_warmup [--render] [template_name ...]
+"""
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+RENDER_HELP = 'Render each template once, throwing output away.'
+
+
+class Command(BaseCommand):
+    help = ('Loads templates (T2P_WARMUP_TEMPLATES by default) with their '
+            'fonts, images and styles, and reports the time taken. Use it '
+            'to check warm-up before enabling T2P_WARMUP_ON_READY, or in '
+            'servers preloading the application before forking workers.')
+    args = '[template_name ...]'
+    if not hasattr(BaseCommand, 'add_arguments'):
+        # optparse options of Django before 1.8
+        option_list = BaseCommand.option_list + (
+            make_option('--render', action='store_true', dest='render',
+                        default=None, help=RENDER_HELP),
+            )
+
+    def add_arguments(self, parser):
+        parser.add_argument('template_names', nargs='*',
+                            metavar='template_name')
+        parser.add_argument('--render', action='store_true', dest='render',
+                            default=None, help=RENDER_HELP)
+
+    def handle(self, *args, **options):
+        from template2pdf.dj import warmup
+        start = time.time()
+        names = warmup(list(args) or options.get('template_names') or None,
+                       options.get('render'))
+        self.stdout.write('Warmed up %d template(s) in %.3fs: %s\n'
+                          %(len(names), time.time()-start, ', '.join(names)))
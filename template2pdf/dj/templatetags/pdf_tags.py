@@ -22,7 +22,7 @@ from django import template
 from django.conf import settings
 from django.template import resolve_variable
 
-from template2pdf.dj import find_resource_abspath, RESOURCE_DIRS
+from template2pdf.dj import find_resource_abspath, setup_dirs, RESOURCE_DIRS
 
 
 register = template.Library()
@@ -48,6 +48,7 @@ class PdfResourceNode(template.Node):
                 actual_path = resolve_variable(self.path, context)
             except template.VariableDoesNotExist:
                 return ''
+        setup_dirs()
         return find_resource_abspath(actual_path, RESOURCE_DIRS) or ''
 
 
@@ -19,14 +19,39 @@
 """PDF renderer, using trml2pdf, for flask-framework
 """
 import os.path
-from jinja2 import contextfunction, Template, TemplateError
+from jinja2 import contextfunction, Environment, FileSystemBytecodeCache, FileSystemLoader, TemplateError
 from werkzeug import escape, Response
 from flask import Module, request
-from template2pdf.utils import FontResolver, find_resource_path, find_resource_abspath, rml2pdf
+from template2pdf.coalesce import fingerprint, SingleFlight
+from template2pdf.conditional import respond, rml_etag
+from template2pdf.utils import FontResolver, find_resource_path, find_resource_abspath, rml2pdf, rml2pdf_records
 
 # make this as a module
 mod = Module(__name__)
 
+# compiled templates kept in memory (recompiled when their file changes)
+TEMPLATE_CACHE_SIZE = 50
+# directory of compiled templates shared by processes (None: temp dir)
+BYTECODE_CACHE_DIR = None
+
+# Jinja environment of templates under this module, built on first use
+# from the settings above (see get_environment); may be set instead
+environment = None
+
+
+def get_environment():
+    """The Jinja environment, built from TEMPLATE_CACHE_SIZE and
+    BYTECODE_CACHE_DIR if not set.
+    """
+    global environment
+    if environment is None:
+        environment = Environment(
+            loader=FileSystemLoader(os.path.join(os.path.dirname(__file__),
+                                                 'templates')),
+            auto_reload=True, cache_size=TEMPLATE_CACHE_SIZE,
+            bytecode_cache=FileSystemBytecodeCache(BYTECODE_CACHE_DIR))
+    return environment
+
 FONT_DIRS = []
 RESOURCE_DIRS = []
 # populate RESOURCE_DIR with 'resources' under project and application dirs
@@ -49,6 +74,12 @@ def populate_font_dirs(dirs=RESOURCE_DIRS, font_dirname='fonts'):
 populate_font_dirs()        
 # font cache
 FONT_CACHE = {}
+# coalesces identical renders in flight (see render_to_pdf); may be
+# replaced by a template2pdf.coalesce.FileSingleFlight, across processes
+flight = SingleFlight()
+# template2pdf.conditional.OutputCache keeping PDF by entity tag for
+# repeated downloads and byte ranges (see direct_to_pdf), None for none
+output_cache = None
 
 font_resolver = FontResolver(FONT_DIRS, FONT_CACHE).resolve_font
 
@@ -84,21 +115,62 @@ def pdf_resource(arg):
 
 def render_to_pdf(template_name, params,
                   font_resolver=font_resolver,
-                  image_resolver=image_resolver):
+                  image_resolver=image_resolver,
+                  sources=None, pages=None, stream=False, coalesce=False,
+                  profile=None):
     """Renders PDF from RML, which is rendered from a Django template.
+
+    sources maps names to Python objects the RML refers to, and pages
+    limits output to some pages, e.g. for previews (see rml2pdf).
+
+    With stream, RML is parsed chunk by chunk while the template renders
+    (see generate), rather than from the whole of its output.
+
+    profile names output options: fast, default or small (see rml2pdf).
+
+    With coalesce, callers rendering the same template, params and pages
+    while a render of them is in flight wait for it and share its PDF
+    (see flight). Only for output depending on these alone. params must
+    be made of strings, numbers, dates, dicts and sequences; otherwise
+    pass as coalesce a key identifying them instead.
     """
-    rml = render_to_string(template_name, params).encode('utf-8')
+    if coalesce:
+        key = coalesce is True and params or coalesce
+        return flight.do(
+            fingerprint(template_name, key, pages, profile), render_to_pdf,
+            template_name, params, font_resolver, image_resolver,
+            sources, pages, stream, False, profile)
+    if stream:
+        rml = generate(template_name, params)
+    else:
+        rml = render_to_string(template_name, params).encode('utf-8')
     try:
-        pdf = rml2pdf(rml, font_resolver, image_resolver)
+        pdf = rml2pdf(rml, font_resolver, image_resolver, sources, pages,
+                      profile=profile)
     except Exception, e:
         raise
         raise TemplateError(str(e))
     return pdf
 
-def render_to_string(template, context={}, processors=None):
+def render_records_to_pdf(template_name, records,
+                          font_resolver=font_resolver,
+                          image_resolver=image_resolver,
+                          sources=None):
+    """Renders one PDF of a template rendered for each of records (a
+    sequence of params), with page numbers restarting per record.
+    """
+    rmls = (render_to_string(template_name, params).encode('utf-8')
+            for params in records)
+    try:
+        pdf = rml2pdf_records(rmls, font_resolver, image_resolver, sources)
+    except Exception, e:
+        raise TemplateError(str(e))
+    return pdf
+
+
+def _process_context(context, processors):
   """
-  A function for template rendering adding useful variables to context
-  automatically, according to the CONTEXT_PROCESSORS settings.
+  Adds variables of processors (functions taking request) to context.
   """
   if processors is None:
     processors = ()
@@ -106,15 +178,46 @@ def render_to_string(template, context={}, processors=None):
     processors = tuple(processors)
   for processor in processors:
     context.update(processor(request))
-  template = Template(mod.open_resource('templates/%s' %(template)).read())
-  return template.render(context)
+  return context
+
+
+def render_to_string(template, context={}, processors=None):
+  """
+  A function for template rendering adding useful variables to context
+  automatically, according to the CONTEXT_PROCESSORS settings.
+  """
+  context = _process_context(context, processors)
+  return get_environment().get_template(template).render(context)
+
+
+def generate(template, context={}, processors=None):
+  """
+  Renders template as render_to_string does, into a generator of
+  unicode chunks produced as rendering goes.
+  """
+  context = _process_context(context, processors)
+  return get_environment().get_template(template).generate(context)
 
 
 def direct_to_pdf(template_name, params=None,
                   pdf_name=None, download=False,
                   font_resolver=font_resolver,
-                  image_resolver=image_resolver):
+                  image_resolver=image_resolver, coalesce=False,
+                  linearize=False, profile=None):
     """Simple generic view to tender rml template.
+
+    The response has an entity tag of the RML and the files it refers to,
+    computed before laying out: If-None-Match is answered with 304 without
+    rendering. PDF is rendered in deterministic mode, the entity tag
+    giving its ID, so the same tag stands for the same bytes. Range
+    requests get the bytes asked for, from output_cache if set.
+
+    coalesce shares renders in flight of the same entity tag, as
+    render_to_pdf does.
+
+    linearize writes linearized PDF, which viewers show from the first
+    page on while the rest downloads (see rml2pdf), and profile names
+    output options (fast, default or small).
     """
     params = params or {}
     params['pdf_resource'] = pdf_resource
@@ -126,10 +229,24 @@ def direct_to_pdf(template_name, params=None,
         else:
             pdf_name = 'download.pdf'
     params['pdf_name'] = pdf_name
-    pdf = render_to_pdf(template_name, params,
-                        font_resolver=font_resolver,
-                        image_resolver=image_resolver)
-    response = Response(pdf, mimetype='application/pdf')
+    rml = render_to_string(template_name, params).encode('utf-8')
+    etag = rml_etag(rml, RESOURCE_DIRS+FONT_DIRS, linearize, profile)
+    def render():
+        try:
+            # same bytes for the same entity tag, for ranges
+            return rml2pdf(rml, font_resolver, image_resolver,
+                           linearize=linearize, profile=profile,
+                           deterministic=etag)
+        except Exception, e:
+            raise TemplateError(str(e))
+    if coalesce:
+        render = lambda render=render: flight.do(etag, render)
+    status, content, headers = respond(
+        etag, request.headers.get('If-None-Match'),
+        request.headers.get('Range'), render, output_cache,
+        request.headers.get('If-Range'))
+    response = Response(content, status=status, headers=headers,
+                        mimetype='application/pdf')
     if download:
         disposition = 'attachment; filename=%s' %(pdf_name)
         response.headers['Content-Disposition'] = disposition
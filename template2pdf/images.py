@@ -0,0 +1,155 @@
+# coding: utf-8
+
+# Copyright (c) 2010, 2011 Accense Technology, Inc. All rights reserved.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Downsampling of images to the size they are placed at.
+
+Images larger than needed at the resolution of the output (e.g. photos
+placed a few centimetres wide) are resampled to it and recompressed:
+JPEG at a given quality, other opaque images as PNG with a palette.
+Results may be kept on disk (ImageCache), by digest of the source and
+target parameters, so an image is processed once across documents.
+
+Needs PIL; without it, images are used as they are.
+"""
+import hashlib
+import math
+import os
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from reportlab.lib.utils import ImageReader
+
+from template2pdf.conditional import OutputCache
+
+# digests of source files by (path, size, mtime)
+DIGEST_CACHE_SIZE = 1024
+digest_cache = {}
+
+
+def source_digest(path):
+    """Digest of the content of file path, read once while it is not
+    modified.
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime)
+    digest = digest_cache.get(key)
+    if digest is None:
+        sha1 = hashlib.sha1()
+        fp = open(path, 'rb')
+        try:
+            for block in iter(lambda: fp.read(65536), ''):
+                sha1.update(block)
+        finally:
+            fp.close()
+        if len(digest_cache)>=DIGEST_CACHE_SIZE:
+            digest_cache.clear()
+        digest = digest_cache[key] = sha1.hexdigest()
+    return digest
+
+
+def target_size(size, width, height, dpi):
+    """Pixel size of an image of size pixels placed at width x height
+    points, at dpi; None if it has no more pixels than that.
+
+    >>> target_size((4000, 3000), 85, 64, 150)
+    (178, 134)
+    >>> target_size((100, 75), 85, 64, 150) is None
+    True
+    """
+    target = (int(math.ceil(width*dpi/72.)), int(math.ceil(height*dpi/72.)))
+    if target[0]>=size[0] or target[1]>=size[1]:
+        return None
+    return target
+
+
+class ImageCache(OutputCache):
+    """Processed images kept in directory by key, at most max_files of
+    them; the least recently used go first.
+    """
+    suffix = '.img'
+
+
+class ImageProcessor(object):
+    """Downsamples images to dpi at their placed size, saving JPEG at
+    quality and other opaque images as PNG of colors colors (full color if
+    None). Images with transparency are kept as PNG in full color.
+
+    cache is an ImageCache keeping results, if given.
+    """
+
+    def __init__(self, dpi=150, quality=80, colors=256, cache=None):
+        self.dpi = dpi
+        self.quality = quality
+        self.colors = colors
+        self.cache = cache
+
+    def process(self, path, size, width, height):
+        """ImageReader of image file path, of size pixels, downsampled
+        for width x height points; None if it needs no downsampling (or
+        PIL is not installed).
+        """
+        if Image is None:
+            return None
+        target = target_size(size, width, height, self.dpi)
+        if target is None:
+            return None
+        key = hashlib.sha1('%s %dx%d %s %s' %(
+            source_digest(path), target[0], target[1], self.quality,
+            self.colors)).hexdigest()
+        data = self.cache and self.cache.get(key)
+        if data is None:
+            data = self.resample(path, target)
+            if self.cache:
+                self.cache.put(key, data)
+        return ImageReader(StringIO(data))
+
+    def resample(self, path, target):
+        """Data of image file path resampled to target pixel size.
+        """
+        image = Image.open(path)
+        format = image.format
+        if format=='JPEG':
+            # decodes at a reduced scale, not less than target
+            image.draft(image.mode, target)
+        if 'transparency' in image.info or image.mode=='LA':
+            image = image.convert('RGBA')
+        elif image.mode in ('1', 'P'):
+            # resampled in color, not by nearest neighbour
+            image = image.convert('RGB')
+        image = image.resize(target, Image.ANTIALIAS)
+        buf = StringIO()
+        if format=='JPEG':
+            if image.mode not in ('L', 'RGB', 'CMYK'):
+                image = image.convert('RGB')
+            image.save(buf, 'JPEG', quality=self.quality, optimize=True)
+        else:
+            if self.colors and 'A' not in image.getbands():
+                image = image.convert('RGB').quantize(self.colors)
+            image.save(buf, 'PNG', optimize=True)
+        return buf.getvalue()
+
+
+if __name__=="__main__":
+    from doctest import testmod
+    testmod()
@@ -0,0 +1,176 @@
+# trml2pdf - An RML to PDF converter
+# Copyright (C) 2003, Fabien Pinckaers, UCL, FSA
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Barcodes for trml2pdf, computed once per symbology, value and size.
+
+Bars (and human readable text) of a barcode are recorded as canvas calls
+when first computed, and replayed for later uses. A barcode drawn more
+than once in a document is written once, as a form XObject.
+"""
+
+import hashlib
+import importlib
+
+from reportlab.platypus.flowables import Flowable
+
+# symbology: (module of reportlab.graphics.barcode, class)
+SYMBOLOGIES = dict(
+    codabar=('common', 'Codabar'), code11=('common', 'Code11'),
+    code128=('code128', 'Code128'),
+    standard39=('code39', 'Standard39'), extended39=('code39', 'Extended39'),
+    standard93=('code93', 'Standard93'), extended93=('code93', 'Extended93'),
+    i2of5=('common', 'I2of5'), msi=('common', 'MSI'),
+    fim=('usps', 'FIM'), postnet=('usps', 'POSTNET'))
+
+DEFAULT_CODE = 'code128'
+
+# classes of symbologies, imported on first use
+barcode_codes = {}
+
+PATTERN_CACHE_SIZE = 4096
+pattern_cache = {}
+
+
+def get_code(code):
+    """Barcode class of symbology code (DEFAULT_CODE if unknown), or None
+    if ReportLab barcodes are not available.
+
+    >>> get_code('standard39').__name__, get_code('nonexistent').__name__
+    ('Standard39', 'Code128')
+    """
+    if code not in SYMBOLOGIES:
+        code = DEFAULT_CODE
+    if code not in barcode_codes:
+        module, name = SYMBOLOGIES[code]
+        try:
+            module = importlib.import_module(
+                'reportlab.graphics.barcode.'+module)
+            barcode_codes[code] = getattr(module, name)
+        except ImportError:
+            barcode_codes[code] = None
+    return barcode_codes[code]
+
+
+class _Recorder(object):
+    """Stands for a canvas, recording calls made on it.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        def record(*args, **kw):
+            self.calls.append((name, args, kw))
+        return record
+
+
+class BarcodePattern(object):
+    """Size and recorded drawing of a barcode.
+    """
+
+    def __init__(self, code, value, params):
+        barcode = get_code(code)(value, **params)
+        barcode._calculate()
+        self.width, self.height = barcode._width, barcode._height
+        recorder = _Recorder()
+        barcode.canv = recorder
+        barcode.draw()
+        self.calls = recorder.calls
+        self.digest = hashlib.md5(repr((code, value, params))).hexdigest()
+
+    def draw(self, canv):
+        for name, args, kw in self.calls:
+            getattr(canv, name)(*args, **kw)
+
+
+def get_pattern(code, value, params):
+    """Get BarcodePattern for symbology code, value and size params,
+    from cache if computed before.
+
+    >>> pattern = get_pattern('code128', '12345', dict(barHeight=20))
+    >>> get_pattern('code128', '12345', dict(barHeight=20)) is pattern
+    True
+    >>> pattern.height, pattern.calls[0][0]
+    (20, 'rect')
+    """
+    if code not in SYMBOLOGIES:
+        code = DEFAULT_CODE
+    key = (code, value, tuple(sorted(params.items())))
+    pattern = pattern_cache.get(key)
+    if pattern is None:
+        if len(pattern_cache)>=PATTERN_CACHE_SIZE:
+            pattern_cache.clear()
+        pattern = pattern_cache[key] = BarcodePattern(code, value, params)
+    return pattern
+
+
+def encode_many(values, code=DEFAULT_CODE, **params):
+    """Compute patterns of many values of one symbology at once.
+
+    Patterns are cached, so documents drawing these values afterwards
+    do not compute them again.
+
+    >>> [p.width>0 for p in encode_many(['1', '2'], 'code39', barHeight=10)]
+    [True, True]
+    """
+    return [get_pattern(code, str(value), params) for value in values]
+
+
+def draw_pattern(canv, pattern):
+    """Draw pattern on canv at origin.
+
+    The first use in a document is drawn inline; when drawn again, the
+    pattern goes into a form XObject shared by later uses.
+    """
+    # form name by digest, False if drawn once; short names are numbered,
+    # as pages list the names of forms they use
+    names = canv._doc.__dict__.setdefault('t2p_barcodes', {})
+    name = names.get(pattern.digest)
+    if name is None:
+        names[pattern.digest] = False
+        pattern.draw(canv)
+        return
+    if not name:
+        forms = canv._doc.__dict__.get('t2p_barcode_forms', 0)+1
+        canv._doc.t2p_barcode_forms = forms
+        name = names[pattern.digest] = 'BC%d' %(forms)
+        w, h = pattern.width, pattern.height
+        # human readable text goes below bars
+        canv.beginForm(name, -w, -2*h-36, 2*w, 2*h)
+        pattern.draw(canv)
+        canv.endForm()
+    canv.doForm(name)
+
+
+class BarcodeFlowable(Flowable):
+    """Flowable drawing a BarcodePattern.
+    """
+
+    def __init__(self, pattern):
+        Flowable.__init__(self)
+        self.pattern = pattern
+        self.width, self.height = pattern.width, pattern.height
+
+    def draw(self):
+        draw_pattern(self.canv, self.pattern)
+
+
+if __name__=="__main__":
+    from doctest import testmod
+    testmod()
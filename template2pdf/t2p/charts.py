@@ -0,0 +1,253 @@
+# trml2pdf - An RML to PDF converter
+# Copyright (C) 2003, Fabien Pinckaers, UCL, FSA
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Chart elements (lineChart, barChart, scatterChart) for trml2pdf.
+
+Series are taken from one of:
+1. data attribute: values separated by comma or space, series separated
+   by ';'. With encoding="base64", each series is base64 of little-endian
+   doubles.
+2. file attribute: CSV file (one series per column) or binary file
+   (.bin, .f64) of little-endian doubles, split into seriesCount series.
+3. source attribute: name of a Python object passed to rml2pdf as
+   sources, holding a sequence of series.
+
+Each series is a sequence of y values (x is the index), or of (x, y)
+pairs for line and scatter charts; numpy arrays are taken as well (a 2D
+array holding (x, y) rows as a series of pairs).
+"""
+
+import array
+import base64
+import csv
+import sys
+
+from reportlab.graphics.shapes import Drawing
+from reportlab.graphics.widgets.markers import makeMarker
+
+import utils
+
+
+# space kept around the plot area for axis labels, in points
+PLOT_PADDING = (30, 20, 10, 10) # left, bottom, right, top
+
+
+def _as_doubles(data):
+    """Convert little-endian doubles in a byte string into a list.
+    """
+    values = array.array('d')
+    values.fromstring(data)
+    if sys.byteorder=='big':
+        values.byteswap()
+    return values.tolist()
+
+
+def decode_series(text, encoding=None):
+    """Decode data attribute into list of series.
+
+    >>> decode_series('1,2,3; 4 5 6')
+    [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]
+    >>> decode_series(base64.b64encode(array.array('d', [0.5, 2]).tostring()),
+    ...               'base64')
+    [[0.5, 2.0]]
+    """
+    series = []
+    for chunk in text.split(';'):
+        if not chunk.strip():
+            continue
+        if encoding=='base64':
+            series.append(_as_doubles(base64.b64decode(chunk.strip())))
+        else:
+            series.append(utils.as_pt_list(chunk.replace(',', ' ')))
+    return series
+
+
+def load_series(path, series_count=1):
+    """Load series from CSV file or binary file of little-endian doubles.
+
+    Leading rows of CSV file which are not numeric (headers) are skipped.
+    """
+    if path.endswith('.bin') or path.endswith('.f64'):
+        values = _as_doubles(open(path, 'rb').read())
+        size = len(values)/series_count
+        return [values[i*size:(i+1)*size] for i in range(series_count)]
+    columns = []
+    for row in csv.reader(open(path, 'rb')):
+        try:
+            row = [float(value) for value in row]
+        except ValueError:
+            if not columns:
+                continue
+            raise
+        if not columns:
+            columns = [[] for value in row]
+        for column, value in zip(columns, row):
+            column.append(value)
+    return columns
+
+
+def decimate(values, buckets):
+    """Reduce values to min/max pairs of given number of buckets.
+
+    Returns list of (index, value) tuples in the original order.
+    Series shorter than two points per bucket are returned as they are.
+
+    >>> decimate([3., 1., 4., 1., 5., 9., 2., 6.], 2)
+    [(1, 1.0), (2, 4.0), (5, 9.0), (6, 2.0)]
+    >>> decimate([3., 1., 4.], 2)
+    [(0, 3.0), (1, 1.0), (2, 4.0)]
+    """
+    count = len(values)
+    if count<=buckets*2 or buckets<1:
+        return list(enumerate(values))
+    numpy = utils.get_numpy()
+    if numpy is not None:
+        return _decimate_numpy(numpy, numpy.asarray(values, dtype=float),
+                               buckets)
+    values = list(values)
+    points = []
+    step = float(count)/buckets
+    for bucket in range(buckets):
+        start, stop = int(bucket*step), int((bucket+1)*step)
+        chunk = values[start:stop]
+        lo = start+chunk.index(min(chunk))
+        hi = start+chunk.index(max(chunk))
+        points.append((min(lo, hi), values[min(lo, hi)]))
+        if lo!=hi:
+            points.append((max(lo, hi), values[max(lo, hi)]))
+    return points
+
+
+def _decimate_numpy(numpy, values, buckets):
+    """Vectorized variant of decimate(), for numpy arrays.
+    """
+    count = len(values)
+    width = -(-count//buckets)
+    padded = numpy.empty(width*buckets)
+    padded[:count] = values
+    padded[count:] = values[-1]
+    grid = padded.reshape(buckets, width)
+    offsets = numpy.arange(buckets)*width
+    lo = numpy.minimum(grid.argmin(axis=1)+offsets, count-1)
+    hi = numpy.minimum(grid.argmax(axis=1)+offsets, count-1)
+    index = numpy.unique(numpy.concatenate((lo, hi)))
+    return zip(index.tolist(), values[index].tolist())
+
+
+def _is_pairs(series):
+    """Whether series holds (x, y) pairs rather than y values.
+    """
+    if getattr(series, 'ndim', 1)>1:
+        return True
+    return len(series)>0 and (isinstance(series[0], (tuple, list))
+                              or getattr(series[0], 'ndim', 0)==1)
+
+
+def decimate_series(series, buckets):
+    """Decimate series of y values or (x, y) pairs into (x, y) pairs.
+
+    >>> decimate_series([(0, 1.), (10, 5.), (20, 2.)], 4)
+    [(0, 1.0), (10, 5.0), (20, 2.0)]
+    """
+    if _is_pairs(series):
+        xs = [point[0] for point in series]
+        ys = [point[1] for point in series]
+        return [(xs[i], y) for i, y in decimate(ys, buckets)]
+    return decimate(series, buckets)
+
+
+def decimate_bars(values, buckets):
+    """Reduce bar values to the one of largest magnitude in each bucket,
+    so both positive and negative peaks are kept.
+
+    >>> decimate_bars([3, 1, 4, 1, 5, 9, 2, 6], 4)
+    [3, 4, 9, 6]
+    >>> decimate_bars([3, -7, 4, 1], 2)
+    [-7, 4]
+    """
+    count = len(values)
+    if count<=buckets or buckets<1:
+        return list(values)
+    step = float(count)/buckets
+    return [max(values[int(i*step):int((i+1)*step)], key=abs)
+            for i in range(buckets)]
+
+
+def get_series(node, sources):
+    """Get series for chart node from its data, file or source attribute.
+    """
+    if node.hasAttribute('data'):
+        return decode_series(node.getAttribute('data'),
+                             node.getAttribute('encoding') or None)
+    elif node.hasAttribute('file'):
+        series_count = int(node.getAttribute('seriesCount') or 1)
+        return load_series(str(node.getAttribute('file')), series_count)
+    elif node.hasAttribute('source'):
+        return list(sources[node.getAttribute('source')])
+    raise ValueError('%s requires data, file or source attribute'
+                     %(node.localName))
+
+
+def _plot_area(width, height):
+    left, bottom, right, top = PLOT_PADDING
+    return left, bottom, width-left-right, height-bottom-top
+
+
+def chart_drawing(node, sources):
+    """Build reportlab Drawing for lineChart/barChart/scatterChart node.
+    """
+    width = utils.as_pt(node.getAttribute('width'))
+    height = utils.as_pt(node.getAttribute('height'))
+    series = [values for values in get_series(node, sources) if len(values)]
+    if not series:
+        raise ValueError('%s has no data' %(node.localName))
+    x, y, plot_width, plot_height = _plot_area(width, height)
+    # one bucket (min/max pair) per point of plot width by default
+    resolution = float(node.getAttribute('resolution') or 1)
+    buckets = int(plot_width*resolution)
+    series_colors = [utils.as_color(col)
+                     for col in node.getAttribute('colors').split()]
+
+    if node.localName=='barChart':
+        from reportlab.graphics.charts.barcharts import VerticalBarChart
+        chart = VerticalBarChart()
+        chart.data = [decimate_bars(values, buckets) for values in series]
+        for i, color in enumerate(series_colors):
+            chart.bars[i].fillColor = color
+    else:
+        from reportlab.graphics.charts.lineplots import LinePlot
+        chart = LinePlot()
+        chart.data = [decimate_series(values, buckets) for values in series]
+        for i, color in enumerate(series_colors):
+            chart.lines[i].strokeColor = color
+        if node.localName=='scatterChart':
+            chart.joinedLines = 0
+            for i in range(len(series)):
+                chart.lines[i].symbol = makeMarker(
+                    node.getAttribute('marker') or 'Circle')
+                chart.lines[i].symbol.size = utils.as_pt(
+                    node.getAttribute('markerSize') or '2')
+    chart.x, chart.y = x, y
+    chart.width, chart.height = plot_width, plot_height
+    drawing = Drawing(width, height)
+    drawing.add(chart)
+    return drawing
+
+
+if __name__=="__main__":
+    from doctest import testmod
+    testmod()
@@ -0,0 +1,515 @@
+# trml2pdf - An RML to PDF converter
+# Copyright (C) 2003, Fabien Pinckaers, UCL, FSA
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Document template, canvases and flowables used for laying out stories.
+"""
+
+from reportlab import rl_config
+from reportlab.pdfbase import pdfdoc
+from reportlab.pdfgen import canvas
+from reportlab import platypus
+
+import output
+
+
+# placeholder for <pageCount/> in paragraph text, replaced before parsing
+PAGE_COUNT = '\x00pageCount\x00'
+
+# layout passes tried until table of contents settles
+MAX_LAYOUT_PASSES = 3
+
+# document information carried over to following parts of split output
+INFO_FIELDS = ('title', 'author', 'subject', 'keywords', 'creator',
+               'producer', 'trapped', '_dateFormatter')
+
+
+class LayoutCanvas(canvas.Canvas):
+    """Canvas for layout-only passes.
+
+    Pages are counted but never serialised, images are not embedded and
+    nothing is written on save().
+    """
+    layout_only = True
+
+    def showPage(self):
+        if self._onPage:
+            self._onPage(self._pageNumber)
+        self._startPage()
+
+    def drawImage(self, image, x, y, width=None, height=None, *args, **kw):
+        return (width, height)
+
+    def drawInlineImage(self, image, x, y, width=None, height=None, *args, **kw):
+        return (width, height)
+
+    def save(self):
+        pass
+
+
+class PreviewCanvas(LayoutCanvas):
+    """Canvas writing pages from first_page on only.
+
+    Earlier pages are laid out as by LayoutCanvas and then discarded, so
+    page numbers of written pages are kept.
+    """
+
+    def __init__(self, *args, **kw):
+        self.first_page = kw.pop('first_page', 1)
+        LayoutCanvas.__init__(self, *args, **kw)
+
+    @property
+    def layout_only(self):
+        return self._pageNumber<self.first_page
+
+    def showPage(self):
+        if self.layout_only:
+            LayoutCanvas.showPage(self)
+        else:
+            canvas.Canvas.showPage(self)
+
+    def drawImage(self, *args, **kw):
+        if self.layout_only:
+            return LayoutCanvas.drawImage(self, *args, **kw)
+        return canvas.Canvas.drawImage(self, *args, **kw)
+
+    def drawInlineImage(self, *args, **kw):
+        if self.layout_only:
+            return LayoutCanvas.drawInlineImage(self, *args, **kw)
+        return canvas.Canvas.drawInlineImage(self, *args, **kw)
+
+    def save(self):
+        canvas.Canvas.save(self)
+
+
+class RollingCanvas(canvas.Canvas):
+    """Canvas writing its pages into a series of PDF files.
+
+    A part is written and dropped once it has max_pages pages, or once
+    its page content (before compression) reaches max_bytes. Following
+    pages go into a new PDF document with the same settings and running
+    page numbers. filename is %-formatted with the part number, from 1.
+    """
+
+    def __init__(self, filename, max_pages=None, max_bytes=None, **kw):
+        self.filename_pattern = filename
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.filenames = []
+        self.part_pages = self.part_bytes = 0
+        self.lang = kw.get('lang')
+        canvas.Canvas.__init__(self, filename %(1), **kw)
+
+    def showPage(self):
+        self.part_bytes += sum([len(code) for code in self._code])
+        canvas.Canvas.showPage(self)
+        self.part_pages += 1
+        if ((self.max_pages and self.part_pages>=self.max_pages)
+            or (self.max_bytes and self.part_bytes>=self.max_bytes)):
+            self._roll()
+
+    def _save_part(self):
+        pack_page(self)
+        # info object is bound to the first document written with it
+        info = pdfdoc.PDFInfo()
+        for name in INFO_FIELDS:
+            setattr(info, name, getattr(self._doc.info, name))
+        self._doc.info = info
+        self._doc.SaveToFile(self._filename, self)
+        self.filenames.append(self._filename)
+
+    def _roll(self):
+        """Write current part and start next one.
+        """
+        self._save_part()
+        old = self._doc
+        self._filename = self.filename_pattern %(len(self.filenames)+1)
+        self._doc = pdfdoc.PDFDocument(
+            compression=old.compression, invariant=old.invariant,
+            filename=self._filename, pdfVersion=old._pdfVersion,
+            lang=self.lang)
+        self._doc.info = old.info
+        fixed = getattr(self, 't2p_fixed', None)
+        if fixed:
+            output.fix_document(self, '%s-%d' %(fixed[0], len(self.filenames)),
+                                fixed[1])
+        self._destinations = {}
+        self.part_pages = self.part_bytes = 0
+        # preamble refers to fonts by names internal to the document
+        self._make_preamble()
+
+    def save(self):
+        if len(self._code):
+            self.showPage()
+        if self.part_pages or not self.filenames:
+            self._save_part()
+
+
+def pack_page(canv):
+    """Compress content of the pages shown on canv since last packed, with
+    the filters of its output profile (see output.apply_options).
+
+    Pages are otherwise kept uncompressed until the document is saved;
+    packed, a long document holds a fraction of its page content.
+    """
+    filters = getattr(canv, 't2p_filters', None) or (
+        rl_config.useA85 and [pdfdoc.PDFBase85Encode, pdfdoc.PDFZCompress]
+        or [pdfdoc.PDFZCompress])
+    for page in reversed(canv._doc.Pages.pages):
+        if page.Contents:
+            break
+        if not page.compression:
+            continue
+        content = page.stream
+        for f in reversed(filters):
+            content = f.encode(content)
+        stream = pdfdoc.PDFStream(content=content)
+        # filters applied already, as told by the Filter entry
+        stream.dictionary['Filter'] = pdfdoc.PDFArray(
+            [pdfdoc.PDFName(f.pdfname) for f in filters])
+        stream.__Comment__ = 'page stream'
+        page.Contents = stream
+        page.stream = None
+
+
+class StreamingDocument(pdfdoc.PDFDocument):
+    """PDF document writing objects into its file as they are finished
+    (see write_object), and the others when saved.
+
+    Objects written are released, and must not change afterwards.
+    Encryption is not supported.
+    """
+
+    def begin(self, fp):
+        """Start writing into file object fp, with the header of the file.
+        """
+        # the header goes first, so at the version any feature needs
+        self.ensureMinPdfVersion(*pdfdoc.PDF_SUPPORT_VERSION)
+        header = pdfdoc.PDFFile(self._pdfVersion)
+        fp.write(header.format(self))
+        self.t2p_file = fp
+        self.t2p_offset = header.offset
+        self.t2p_written = set()
+
+    def write_object(self, obj):
+        """Write obj into the file now; returns a reference to it.
+        """
+        ref = self.Reference(obj)
+        data = pdfdoc.PDFIndirectObject(ref.name, obj).format(self)
+        self.t2p_file.write(data)
+        self.idToOffset[ref.name] = self.t2p_offset
+        self.t2p_offset += len(data)
+        self.t2p_written.add(ref.name)
+        self.idToObject[ref.name] = None
+        return ref
+
+    def format(self):
+        """Rest of the file: objects not written yet, cross-reference table
+        and trailer, as PDFDocument.format() gives for the whole file.
+        """
+        self.Reference(self.Catalog)
+        self.Reference(self.info)
+        rest = pdfdoc.PDFFile(self._pdfVersion)
+        del rest.strings[:]
+        rest.offset = self.t2p_offset
+        ids = []
+        # objects may refer to new ones while formatted
+        while len(ids)+1 in self.numberToId:
+            name = self.numberToId[len(ids)+1]
+            if name not in self.t2p_written:
+                self.idToOffset[name] = rest.add(pdfdoc.PDFIndirectObject(
+                    name, self.idToObject[name]).format(self))
+            ids.append(name)
+        xref = pdfdoc.PDFCrossReferenceTable()
+        xref.addsection(0, ids)
+        startxref = rest.add(xref.format(self))
+        rest.add(pdfdoc.PDFTrailer(
+            startxref=startxref, Size=len(ids)+1,
+            Root=self.Reference(self.Catalog), Info=self.Reference(self.info),
+            ID=self.ID()).format(self))
+        return rest.format(self)
+
+
+class StreamingCanvas(canvas.Canvas):
+    """Canvas writing the content of each page into its file once the
+    page is shown, instead of keeping it until saved.
+
+    Page content is compressed as by pack_page; other objects (fonts,
+    images, page dictionaries) are written on save.
+    """
+
+    def __init__(self, filename, **kw):
+        canvas.Canvas.__init__(self, filename, **kw)
+        old = self._doc
+        self._doc = StreamingDocument(
+            compression=old.compression, invariant=old.invariant,
+            pdfVersion=old._pdfVersion, lang=kw.get('lang'))
+        self._doc.info = old.info
+        # preamble refers to fonts by names internal to the document
+        self._make_preamble()
+        self.t2p_close = not hasattr(filename, 'write')
+        if self.t2p_close:
+            self._filename = open(filename, 'wb')
+        self._doc.begin(self._filename)
+
+    def showPage(self):
+        canvas.Canvas.showPage(self)
+        pack_page(self)
+        page = self._doc.Pages.pages[-1]
+        if not page.Contents:
+            # uncompressed
+            page.Contents = pdfdoc.PDFStream(content=page.stream)
+            page.stream = None
+        page.Contents = self._doc.write_object(page.Contents)
+
+    def save(self):
+        canvas.Canvas.save(self)
+        if self.t2p_close:
+            self._filename.close()
+
+
+def page_range(pages):
+    """Normalise pages option into (first, last) page numbers.
+
+    pages is a number of leading pages or a (first, last) pair, both
+    counted from 1; last may be None for the end of the document.
+
+    >>> page_range(None), page_range(1), page_range((3, 5)), page_range((2, None))
+    (None, (1, 1), (3, 5), (2, None))
+    """
+    if pages is None:
+        return None
+    if isinstance(pages, (int, long)):
+        return (1, pages)
+    first, last = pages
+    return (first or 1, last)
+
+
+class LazyStory(list):
+    """Story list building flowables from an iterable as they are reached.
+
+    Platypus consumes the story from its front; only a few flowables ahead
+    of the current one (e.g. for keepWithNext) are built.
+    """
+    lookahead = 16
+
+    def __init__(self, flowables):
+        list.__init__(self)
+        self.flowables = iter(flowables)
+
+    def _fill(self, size):
+        while self.flowables is not None and list.__len__(self)<size:
+            try:
+                self.append(self.flowables.next())
+            except StopIteration:
+                self.flowables = None
+
+    def __len__(self):
+        self._fill(self.lookahead)
+        return list.__len__(self)
+
+    def __getitem__(self, index):
+        if isinstance(index, int) and index>=0:
+            self._fill(index+1)
+        return list.__getitem__(self, index)
+
+
+class LastPage(Exception):
+    """Raised to stop laying out after the last page requested.
+    """
+
+
+class Paragraph(platypus.Paragraph):
+    """Paragraph which remembers its last measurement.
+
+    Wrapping again at the same width (e.g. in the final pass after a
+    layout pass) reuses the lines broken before.
+    """
+    _measured = None
+
+    def wrap(self, availWidth, availHeight):
+        measured = self._measured
+        if measured and measured[0]==availWidth:
+            (self.width, self.height,
+             self.blPara, self._wrapWidths) = measured[1:]
+            return self.width, self.height
+        res = platypus.Paragraph.wrap(self, availWidth, availHeight)
+        if hasattr(self, 'blPara'):
+            self._measured = (availWidth, self.width, self.height,
+                              self.blPara, self._wrapWidths)
+        return res
+
+
+class DeferredParagraph(Paragraph):
+    """Paragraph holding values only known after layout, e.g. page count.
+
+    The text is rebuilt from the values of counter (an object with
+    page_count attribute) when they change.
+    """
+
+    def __init__(self, text, style=None, bulletText=None, frags=None,
+                 caseSensitive=1, encoding='utf8', counter=None):
+        # split() creates plain parts from frags, without counter.
+        self._template = text
+        self._counter = counter
+        if counter is not None:
+            text = self._expand()
+        Paragraph.__init__(self, text, style, bulletText, frags,
+                           caseSensitive, encoding)
+
+    def _expand(self):
+        self._page_count = self._counter.page_count
+        return self._template.replace(PAGE_COUNT, str(self._page_count or 0))
+
+    def wrap(self, availWidth, availHeight):
+        if (self._counter is not None
+            and self._counter.page_count!=self._page_count):
+            self._setup(self._expand(), self.style, self.bulletText, None,
+                        platypus.paragraph.cleanBlockQuotedText)
+            self._measured = None
+        return Paragraph.wrap(self, availWidth, availHeight)
+
+
+class DeferredFlowable(platypus.Flowable):
+    """Flowable of text holding values only known after layout, other
+    than a paragraph (e.g. preformatted text).
+
+    The flowable is built by make(text) from the values of counter, and
+    built again when they change.
+    """
+
+    def __init__(self, text, make, counter):
+        self._template = text
+        self._make = make
+        self._counter = counter
+        self._flowable = None
+
+    def _current(self):
+        page_count = self._counter.page_count
+        if self._flowable is None or page_count!=self._page_count:
+            self._page_count = page_count
+            self._flowable = self._make(
+                self._template.replace(PAGE_COUNT, str(page_count or 0)))
+        return self._flowable
+
+    def wrap(self, availWidth, availHeight):
+        self.width, self.height = self._current().wrap(availWidth,
+                                                       availHeight)
+        return self.width, self.height
+
+    def split(self, availWidth, availHeight):
+        return self._current().split(availWidth, availHeight)
+
+    def getSpaceBefore(self):
+        return self._current().getSpaceBefore()
+
+    def getSpaceAfter(self):
+        return self._current().getSpaceAfter()
+
+    def draw(self):
+        self._flowable.drawOn(self.canv, 0, 0)
+
+
+class RmlDocTemplate(platypus.BaseDocTemplate):
+    """Document template which lays out the story as many times as needed.
+
+    Headings flagged with _toc_level are reported to the table of contents.
+    """
+    last_page = None
+    # compression options of output (output.apply_options)
+    options = None
+    # (seed, timestamp) fixing dates and ID of output (output.fix_document)
+    fixed = None
+
+    def _startBuild(self, filename=None, canvasmaker=canvas.Canvas):
+        platypus.BaseDocTemplate._startBuild(self, filename, canvasmaker)
+        if self.options:
+            output.apply_options(self.canv, self.options)
+        if self.fixed:
+            output.fix_document(self.canv, *self.fixed)
+
+    def handle_pageEnd(self):
+        platypus.BaseDocTemplate.handle_pageEnd(self)
+        pack_page(self.canv)
+        if self.last_page and self.page>=self.last_page:
+            raise LastPage()
+
+    def build(self, flowables, filename=None, canvasmaker=canvas.Canvas,
+              pages=None):
+        """Build document, or the pages given as (first, last) only.
+
+        Pages before the range are laid out without drawing page graphics
+        and are not written. Layout stops after the last page.
+        """
+        if pages is None:
+            return platypus.BaseDocTemplate.build(self, flowables, filename,
+                                                  canvasmaker)
+        first, self.last_page = pages
+        def canvasmaker(*args, **kw):
+            return PreviewCanvas(first_page=first, *args, **kw)
+        try:
+            platypus.BaseDocTemplate.build(self, flowables, filename,
+                                           canvasmaker)
+        except LastPage:
+            self.canv.save()
+        finally:
+            self.last_page = None
+
+    def afterFlowable(self, flowable):
+        level = getattr(flowable, '_toc_level', None)
+        if level is not None:
+            self.notify('TOCEntry', (level, flowable.getPlainText(), self.page))
+
+    def layout(self, story, counter, deferred=False):
+        """Lays story out without writing PDF, until page count and
+        table of contents settle, and stores page count into counter.
+
+        deferred tells the story itself shows the page count, so another
+        pass is needed when it changes.
+        """
+        indexing = [f for f in story if f.isIndexing()]
+        self._indexingFlowables = indexing
+        for f in story:
+            getattr(f, 'rewind', lambda record: None)(True)
+        # changes made to flowables while laying out (e.g. _postponed
+        # marks), undone after each pass as multiBuild() does
+        edits = []
+        self._multiBuildEdits = edits.append
+        for i in range(MAX_LAYOUT_PASSES):
+            for f in indexing:
+                f.beforeBuild()
+            self.build(story[:], canvasmaker=LayoutCanvas)
+            for f in indexing:
+                f.afterBuild()
+            for edit in edits:
+                # marks may be gone already (e.g. BoundTable.split)
+                if edit[0] is not delattr or hasattr(*edit[1:]):
+                    edit[0](*edit[1:])
+            del edits[:]
+            page_count, counter.page_count = counter.page_count, self.page
+            for f in story:
+                getattr(f, 'rewind', lambda record: None)(False)
+            if ((page_count==counter.page_count or not deferred)
+                and not [f for f in indexing if not f.isSatisfied()]):
+                break
+        del self._multiBuildEdits
+        for f in indexing:
+            f.beforeBuild()
+
+
+if __name__=="__main__":
+    from doctest import testmod
+    testmod()
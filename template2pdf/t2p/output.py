@@ -0,0 +1,273 @@
+# trml2pdf - An RML to PDF converter
+# Copyright (C) 2003, Fabien Pinckaers, UCL, FSA
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Output profiles and post-processing of PDF written by trml2pdf.
+
+Profiles trade render time for file size:
+
+fast
+  page content is neither compressed nor ASCII85 encoded.
+default
+  ReportLab settings.
+small
+  page content is compressed at the highest zlib level, without ASCII85,
+  then objects are packed into compressed object streams and streams are
+  recompressed by qpdf (decoding ASCII85 of images and fonts).
+
+Options apply to the document rendered only; images and fonts are
+encoded as ReportLab settings tell, which are process-wide.
+
+Images are deduplicated by content within a document under any profile
+(resolvers give ImageReader objects, named by a digest of their data).
+
+Linearized ("fast web view") PDF starts with the objects of the first
+page and hint tables, so viewers show the first page before the rest of
+the file arrives. ReportLab does not write it; PDF is rewritten by an
+external tool, qpdf by default.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import warnings
+import zlib
+
+from reportlab import rl_config
+from reportlab.lib.utils import TimeStamp
+from reportlab.pdfbase import pdfdoc
+
+
+# command linearizing the PDF file named by the first argument added into
+# the file named by the second; qpdf derives the IDs it writes from the
+# content (--deterministic-id), so deterministic output stays so
+LINEARIZE_COMMAND = ['qpdf', '--linearize', '--deterministic-id']
+
+# options of profiles: compression of page content, its ASCII85 encoding,
+# its zlib level, and command rewriting PDF as LINEARIZE_COMMAND does;
+# applied per document (see apply_options)
+PROFILES = {
+    'fast': dict(compression=0, a85=0),
+    'default': dict(),
+    'small': dict(compression=1, a85=0, level=9,
+                  rewrite=['qpdf', '--deterministic-id',
+                           '--object-streams=generate',
+                           '--recompress-flate', '--compression-level=9']),
+    }
+DEFAULT_PROFILE = 'default'
+
+# qpdf options by the version of qpdf they appeared in
+QPDF_OPTIONS = {'--compression-level': (10, 0)}
+_qpdf_version = []
+
+
+class ZCompress(object):
+    """Flate stream filter compressing at zlib level.
+    """
+    pdfname = 'FlateDecode'
+
+    def __init__(self, level):
+        self.level = level
+
+    def encode(self, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf8')
+        return zlib.compress(text, self.level)
+
+    def decode(self, encoded):
+        return zlib.decompress(encoded)
+
+
+def get_profile(name=None):
+    """Options of profile name (DEFAULT_PROFILE if None).
+
+    >>> get_profile('fast')['compression'], get_profile()
+    (0, {})
+    >>> get_profile('tiny')
+    Traceback (most recent call last):
+    ...
+    ValueError: unknown output profile: tiny
+    """
+    try:
+        return PROFILES[name or DEFAULT_PROFILE]
+    except KeyError:
+        raise ValueError('unknown output profile: %s' %(name))
+
+
+def apply_options(canv, options):
+    """Apply compression options of a profile to the document of canv.
+
+    Page content is compressed by layout.pack_page() with the filters set
+    here. Images and fonts are encoded as ReportLab settings tell
+    (rl_config.useA85), which are process-wide.
+    """
+    if 'compression' in options:
+        canv.setPageCompression(options['compression'])
+    compress = pdfdoc.PDFZCompress
+    if 'level' in options:
+        compress = ZCompress(options['level'])
+    if options.get('a85', rl_config.useA85):
+        canv.t2p_filters = [pdfdoc.PDFBase85Encode, compress]
+    else:
+        canv.t2p_filters = [compress]
+
+
+class FixedTimeStamp(object):
+    """Time stamp at t seconds since the epoch, in UTC, for PDF dates.
+    """
+
+    def __init__(self, t):
+        self.t = t
+        self.lt = time.gmtime(t)
+        self.YMDhms = tuple(self.lt)[:6]
+        self.dhh = self.dmm = 0
+        self.tzname = 'UTC'
+
+
+def fix_document(canv, seed, timestamp=None):
+    """Fix creation date and ID of the PDF document of canv, which
+    otherwise come from the time of rendering.
+
+    Dates are at timestamp (seconds since the epoch), by default at the
+    date of ReportLab's invariant mode; the ID is a digest of seed (e.g.
+    a digest of the input).
+
+    >>> from reportlab.pdfgen.canvas import Canvas
+    >>> canv = Canvas(None)
+    >>> fix_document(canv, 'input', 0)
+    >>> canv._doc._timeStamp.YMDhms, canv._doc.ID()[2:10]
+    ((1970, 1, 1, 0, 0, 0), '<a43c1b0')
+    """
+    doc = canv._doc
+    doc.invariant = 1
+    if timestamp is None:
+        doc._timeStamp = TimeStamp(1)
+    else:
+        doc._timeStamp = FixedTimeStamp(timestamp)
+    ids = pdfdoc.PDFText(hashlib.md5(seed).digest(), enc='raw').format(
+        pdfdoc.DummyDoc())
+    doc._ID = '\n[%s%s]\n' %(ids, ids)
+    # applied to following documents, e.g. parts of split output
+    canv.t2p_fixed = (seed, timestamp)
+
+
+regex_linearized = re.compile(r'/Linearized\b')
+
+
+def is_linearized(pdf):
+    """Whether pdf is linearized, as told by its first object.
+
+    >>> is_linearized('%PDF-1.4 1 0 obj << /Linearized 1 /L 2 >> endobj')
+    True
+    >>> is_linearized('%PDF-1.4 1 0 obj << /Type /Catalog >> endobj')
+    False
+    """
+    return bool(regex_linearized.search(pdf[:1024]))
+
+
+def linearize(pdf):
+    """Linearize pdf with LINEARIZE_COMMAND.
+
+    pdf is returned as it is, with a RuntimeWarning, if the command is not
+    installed. Raises RuntimeError if it fails.
+    """
+    return rewrite(pdf, LINEARIZE_COMMAND)
+
+
+def qpdf_version():
+    """Version of qpdf installed, as a tuple of numbers; None if it is not
+    installed.
+    """
+    if not _qpdf_version:
+        try:
+            out = subprocess.Popen(['qpdf', '--version'],
+                                   stdout=subprocess.PIPE).communicate()[0]
+            match = re.search(r'(\d+)\.(\d+)', out)
+            version = match and tuple([int(n) for n in match.groups()])
+        except OSError:
+            version = None
+        _qpdf_version.append(version)
+    return _qpdf_version[0]
+
+
+def supported(command):
+    """command without the options of QPDF_OPTIONS the installed qpdf is
+    too old for.
+
+    >>> _qpdf_version[:] = [(9, 1)]
+    >>> supported(['qpdf', '--compression-level=9', '--linearize'])
+    ['qpdf', '--linearize']
+    >>> del _qpdf_version[:]
+    """
+    version = command[0]=='qpdf' and qpdf_version()
+    if not version:
+        return command
+    return [arg for arg in command
+            if QPDF_OPTIONS.get(arg.split('=')[0], ())<=version]
+
+
+def rewrite(pdf, command):
+    """Rewrite pdf with command, given names of input and output files.
+
+    pdf is returned as it is, with a RuntimeWarning, if the command is not
+    installed. Raises RuntimeError if it fails.
+
+    >>> with warnings.catch_warnings(record=True) as caught:
+    ...     warnings.simplefilter('always')
+    ...     rewrite('%PDF-1.4', ['t2p-no-such-command'])
+    ...     print caught[0].message
+    '%PDF-1.4'
+    t2p-no-such-command is not installed; PDF is left as it is
+    """
+    command = supported(command)
+    directory = tempfile.mkdtemp()
+    try:
+        source = os.path.join(directory, 'in.pdf')
+        target = os.path.join(directory, 'out.pdf')
+        fp = open(source, 'wb')
+        fp.write(pdf)
+        fp.close()
+        try:
+            status = subprocess.call(command+[source, target])
+        except OSError:
+            warnings.warn('%s is not installed; PDF is left as it is'
+                          %(command[0]), RuntimeWarning)
+            return pdf
+        # qpdf exits with 3 when it has warnings, having written output
+        if status not in (0, 3) or not os.path.exists(target):
+            raise RuntimeError('%s failed with exit status %d'
+                               %(command[0], status))
+        return open(target, 'rb').read()
+    finally:
+        shutil.rmtree(directory)
+
+
+def rewrite_file(filename, command):
+    """Rewrite PDF file filename in place with command (see rewrite).
+    """
+    pdf = open(filename, 'rb').read()
+    fp = open(filename, 'wb')
+    fp.write(rewrite(pdf, command))
+    fp.close()
+
+
+if __name__=="__main__":
+    from doctest import testmod
+    testmod()
@@ -0,0 +1,156 @@
+# trml2pdf - An RML to PDF converter
+# Copyright (C) 2003, Fabien Pinckaers, UCL, FSA
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Static page layers (<static>) drawn once and reused across documents.
+
+Content of <static> is drawn on a scratch canvas the first time it is
+seen, and its page operators are cached, keyed by the node's XML. Each
+document then gets the operators once, as a form XObject shown on every
+page. Font names in the operators are internal to a document, so they are
+mapped to the fonts of the document the form is written to.
+
+Content whose output depends on the page or the document (page numbers,
+images, embedded TrueType subsets, transparency...) is not cached, and is
+drawn on each page as usual.
+"""
+
+import hashlib
+import re
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+from reportlab.pdfgen import canvas
+
+
+STATIC_CACHE_SIZE = 64
+static_cache = {}
+
+# elements whose output differs between pages or documents
+VARIABLE_TAGS = ('pageNumber', 'pageCount', 'image')
+
+regex_static = re.compile(r'<static\b(?:[^>]*/>|.*?</static>)', re.S)
+regex_font = re.compile(r'(/\S+)( \S+ Tf)')
+# named resources other than fonts, bound to the document they are in
+regex_resource = re.compile(r'/\S+ (Do|gs|cs|CS|sh)\b')
+
+
+def static_key(node):
+    """Cache key of <static> node, from its XML.
+    """
+    return hashlib.md5(node.toxml().encode('utf-8')).hexdigest()
+
+
+def static_keys(data, dom):
+    """Map <static> nodes of dom to cache keys, from XML source data.
+
+    Hashing source is much cheaper than serializing nodes again. Returns
+    empty mapping if source and nodes do not match up (e.g. <static> in
+    comments), leaving keys to static_key().
+
+    >>> from xml.dom.minidom import parseString
+    >>> data = '<a><static><rect/></static><static/></a>'
+    >>> len(set(static_keys(data, parseString(data)).values()))
+    2
+    >>> data = '<a><!-- <static/> --></a>'
+    >>> static_keys(data, parseString(data))
+    {}
+    """
+    if '<static' not in data:
+        return {}
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    nodes = dom.getElementsByTagName('static')
+    sources = regex_static.findall(data)
+    if len(nodes)!=len(sources):
+        return {}
+    return dict(zip(nodes, [hashlib.md5(source).hexdigest()
+                            for source in sources]))
+
+
+def capture(node, draw, pagesize):
+    """Draw node with draw(canvas) on a scratch canvas.
+
+    Returns (operators, fonts), fonts mapping internal font names used in
+    operators to font names, or None if output can not be reused.
+
+    >>> from xml.dom.minidom import parseString
+    >>> node = parseString('<static/>').documentElement
+    >>> ops, fonts = capture(node, lambda c: c.setFont('Courier', 6), (99, 99))
+    >>> ops, fonts['/F2']
+    ('BT /F2 6 Tf 7.2 TL ET', 'Courier')
+    >>> capture(parseString('<static><pageNumber/></static>').documentElement,
+    ...         None, (99, 99))
+    """
+    for tag in VARIABLE_TAGS:
+        if node.getElementsByTagName(tag):
+            return None
+    canv = canvas.Canvas(StringIO(), pagesize=pagesize)
+    draw(canv)
+    ops = '\n'.join(canv._code)
+    fonts = dict([(internal, name)
+                  for name, internal in canv._doc.fontMapping.items()])
+    if regex_resource.search(ops):
+        return None
+    for internal, operator in regex_font.findall(ops):
+        if internal not in fonts:
+            return None
+    return ops, fonts
+
+
+def get_static(node, draw, pagesize, key=None):
+    """Get cached (operators, fonts) of node, capturing on first use.
+    """
+    key = key or static_key(node)
+    if key not in static_cache:
+        if len(static_cache)>=STATIC_CACHE_SIZE:
+            static_cache.clear()
+        static_cache[key] = capture(node, draw, pagesize)
+    return static_cache[key]
+
+
+def draw_static(canv, node, draw, key=None):
+    """Draw <static> node on canv as a form XObject of its document.
+
+    draw(canvas) draws the node's content; it is used once per cache
+    entry, or on every page if the content can not be reused.
+    """
+    key = key or static_key(node)
+    name = 'T2PStatic%s' %(key[:16])
+    if not canv.hasForm(name):
+        static = get_static(node, draw, canv._pagesize, key)
+        if static is None:
+            canv.saveState()
+            draw(canv)
+            canv.restoreState()
+            return
+        ops, fonts = static
+        def font_name(match):
+            return (canv._doc.getInternalFontName(fonts[match.group(1)])
+                    + match.group(2))
+        w, h = canv._pagesize
+        # content may be moved off the page by transforms of pageGraphics
+        canv.beginForm(name, -w, -h, 2*w, 2*h)
+        canv._code.append(regex_font.sub(font_name, ops))
+        canv.endForm()
+    canv.doForm(name)
+
+
+if __name__=="__main__":
+    from doctest import testmod
+    testmod()
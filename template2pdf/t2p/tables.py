@@ -0,0 +1,464 @@
+# trml2pdf - An RML to PDF converter
+# Copyright (C) 2003, Fabien Pinckaers, UCL, FSA
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Table flowables for trml2pdf.
+"""
+
+import re
+from collections import deque
+
+from reportlab.lib import enums
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus.flowables import Flowable, Spacer
+from reportlab.platypus.tables import Table
+
+import layout
+
+
+def get_field(item, field):
+    """Get field value from a mapping, a sequence or an object.
+
+    >>> get_field({'name': 'spam'}, 'name'), get_field(('spam', 'egg'), '1')
+    ('spam', 'egg')
+    >>> class Item(object): name = 'ham'
+    >>> get_field(Item(), 'name')
+    'ham'
+    """
+    if isinstance(item, dict):
+        return item[field]
+    if field.isdigit():
+        return item[int(field)]
+    return getattr(item, field)
+
+
+regex_field = re.compile(r'%\((\w+)\)s')
+
+def fill_fields(text, item):
+    """Replace %(field)s in text with fields of item; other % are kept.
+
+    >>> fill_fields(u'%(name)s: 100%', {'name': 'spam'})
+    u'spam: 100%'
+    """
+    return regex_field.sub(
+        lambda match: unicode(get_field(item, match.group(1))), text)
+
+
+class RowTemplate(object):
+    """Builds table rows from items, as declared by <rowTemplate>.
+
+    Each cell is a (field, format) pair; format is a %-format string or
+    None for unicode().
+
+    >>> RowTemplate([('name', None), ('qty', '%03d')])({'name': 'a', 'qty': 7})
+    [u'a', '007']
+    """
+
+    def __init__(self, cells):
+        self.cells = cells
+
+    def __call__(self, item):
+        row = []
+        for field, format in self.cells:
+            value = get_field(item, field)
+            if format:
+                row.append(format %(value))
+            else:
+                row.append(unicode(value))
+        return row
+
+
+def continuation_style(commands, static_count, repeat_rows):
+    """Rebase table style commands for a continued (non-first) chunk.
+
+    Continued chunks start with repeat_rows of the static_count static
+    rows. Commands on static rows which are not repeated are dropped,
+    commands running to the end (negative stop row) are kept.
+
+    >>> continuation_style([('GRID', (0, 0), (-1, -1), 1, 'black'),
+    ...                     ('BACKGROUND', (0, 0), (-1, 0), 'gray'),
+    ...                     ('FONT', (0, 2), (-1, -1), 'Helvetica')], 2, 1)
+    [('GRID', (0, 0), (-1, -1), 1, 'black'), ('BACKGROUND', (0, 0), (-1, 0), 'gray'), ('FONT', (0, 1), (-1, -1), 'Helvetica')]
+    >>> continuation_style([('BACKGROUND', (0, 0), (-1, 0), 'gray')], 1, 0)
+    []
+    """
+    res = []
+    for command in commands:
+        op, (sc, sr), (ec, er) = command[:3]
+        if er>=0 and er<repeat_rows:
+            res.append(command)
+        elif er<0:
+            if sr>=static_count:
+                sr -= static_count-repeat_rows
+            elif sr>=repeat_rows:
+                sr = repeat_rows
+            res.append((op, (sc, sr), (ec, er))+tuple(command[3:]))
+    return res
+
+
+# table cell alignment of paragraph alignment, for a single line
+CELL_ALIGNMENTS = {enums.TA_LEFT: 'LEFT', enums.TA_CENTER: 'CENTER',
+                   enums.TA_RIGHT: 'RIGHT', enums.TA_JUSTIFY: 'LEFT'}
+
+def plain_text(text, style):
+    """Text of a paragraph in style, if it can be drawn as a plain string
+    table cell (no markup, indents, spacing or decorations), else None.
+
+    >>> from reportlab.lib.styles import ParagraphStyle
+    >>> plain_text('  12.50   EUR ', ParagraphStyle('s'))
+    '12.50 EUR'
+    >>> plain_text('<b>12.50</b>', ParagraphStyle('s'))
+    >>> plain_text('12.50', ParagraphStyle('s', leftIndent=5))
+
+    Page count is only known after layout (see layout.DeferredParagraph).
+
+    >>> plain_text('Total %s' %(layout.PAGE_COUNT), ParagraphStyle('s'))
+    """
+    text = ' '.join(text.split())
+    if (not text or '<' in text or '&' in text or layout.PAGE_COUNT in text
+        or style.alignment not in CELL_ALIGNMENTS
+        or style.leftIndent or style.rightIndent or style.firstLineIndent
+        or style.spaceBefore or style.spaceAfter or style.backColor
+        or style.borderWidth or getattr(style, 'bulletText', None)
+        or getattr(style, 'textTransform', None)
+        or getattr(style, 'justifyLastLine', 0)
+        or getattr(style, 'endDots', None)):
+        return None
+    return text
+
+
+def fit_plain_cells(table, cells, widths, make_flowable):
+    """Replace plain string cells of table which do not fit on a line of
+    their column with flowables.
+
+    cells maps (row, column) to arguments of make_flowable. widths are
+    column widths, None if unknown. Cells are measured in their table
+    cell font, so table style must be set already.
+    """
+    values, styles = table._cellvalues, table._cellStyles
+    for (row, col), args in cells.items():
+        style = styles[row][col]
+        if (not widths or widths[col] is None
+            or stringWidth(values[row][col], style.fontname, style.fontsize)
+               > widths[col]-style.leftPadding-style.rightPadding):
+            values[row][col] = [make_flowable(*args)]
+
+
+def plain_cell_commands(cells):
+    """Table style commands drawing plain string cells in the font, color
+    and alignment of their paragraph styles.
+
+    cells maps (row, column) to paragraph style; runs of cells down a
+    column sharing one style share commands.
+
+    >>> from reportlab.lib.styles import ParagraphStyle
+    >>> s, t = ParagraphStyle('s'), ParagraphStyle('t', alignment=2)
+    >>> commands = plain_cell_commands({(0, 1): s, (1, 1): s, (2, 1): t})
+    >>> [command for command in commands if command[0]=='ALIGNMENT']
+    [('ALIGNMENT', (1, 0), (1, 1), 'LEFT'), ('ALIGNMENT', (1, 2), (1, 2), 'RIGHT')]
+    """
+    columns = {}
+    for (row, col), style in cells.items():
+        columns.setdefault(col, []).append((row, style))
+    commands = []
+    for col, column in sorted(columns.items()):
+        column.sort()
+        runs = []
+        for row, style in column:
+            if runs and runs[-1][1]==row-1 and runs[-1][2] is style:
+                runs[-1][1] = row
+            else:
+                runs.append([row, row, style])
+        for start, stop, style in runs:
+            start, stop = (col, start), (col, stop)
+            commands.extend([
+                ('FONT', start, stop, style.fontName, style.fontSize,
+                 style.leading),
+                ('TEXTCOLOR', start, stop, style.textColor),
+                ('ALIGNMENT', start, stop, CELL_ALIGNMENTS[style.alignment])])
+    return commands
+
+
+def cell_widths(value, style, wrap=False):
+    """Least and one-line widths of table cell value in cell style,
+    paddings included.
+
+    Strings are not wrapped unless wrap is set, paragraphs are.
+
+    >>> from reportlab.platypus.tables import CellStyle
+    >>> style = CellStyle('cell')
+    >>> [int(w) for w in cell_widths('spam egg', style)]
+    [55, 55]
+    >>> [int(w) for w in cell_widths('spam egg', style, wrap=True)]
+    [36, 55]
+    """
+    padding = style.leftPadding+style.rightPadding
+    if isinstance(value, Flowable):
+        value = [value]
+    if not isinstance(value, (list, tuple)):
+        lines = str(value).split('\n')
+        most = max([stringWidth(line, style.fontname, style.fontsize)
+                    for line in lines])
+        least = most
+        if wrap:
+            least = max([stringWidth(word, style.fontname, style.fontsize)
+                         for word in ' '.join(lines).split() or ['']])
+        return least+padding, most+padding
+    least = most = 0
+    for flowable in value:
+        try:
+            low = high = flowable.minWidth()
+        except AttributeError:
+            continue
+        if hasattr(flowable, 'getPlainText'):
+            para = flowable.style
+            high = (stringWidth(flowable.getPlainText(), para.fontName,
+                                para.fontSize)
+                    + para.leftIndent + para.rightIndent
+                    + max(para.firstLineIndent, 0))
+        least, most = max(least, low), max(most, low, high)
+    return least+padding, most+padding
+
+
+def share_width(least, most, width):
+    """Column widths between least and most widths, using up width.
+
+    Columns get their most width if all fit, else their least width and
+    a share of what is left proportional to what they lack.
+
+    >>> share_width([10, 20], [30, 20], 100), share_width([10, 20], [30, 20], 40)
+    ([30, 20], [20.0, 20.0])
+    """
+    if sum(most)<=width:
+        return list(most)
+    spare, lacking = width-sum(least), float(sum(most)-sum(least))
+    if spare<=0:
+        return list(least)
+    return [low+(high-low)*spare/lacking for low, high in zip(least, most)]
+
+
+class AutoWidthTable(Table):
+    """Table sizing its columns from a sample of its rows.
+
+    Sampled rows are the first sample_rows rows and, for each column, the
+    row of its longest text. Widths are fixed on first wrap, for the
+    available width then, and kept by tables split from this one.
+
+    Plain string cells (plain_cells, arguments of make_flowable by
+    (row, column)) may be wrapped; those which do not fit their column
+    then are made flowables, see fit_plain_cells().
+    """
+    sample_rows = 50
+    plain_cells = {}
+    make_flowable = None
+
+    def _sample(self):
+        rows = set(range(min(self.sample_rows, self._nrows)))
+        longest = [(-1, 0)]*self._ncols
+        for row, values in enumerate(self._cellvalues):
+            for col, value in enumerate(values):
+                if isinstance(value, str):
+                    size = len(value)
+                elif (isinstance(value, list) and len(value)==1
+                      and hasattr(value[0], 'getPlainText')):
+                    size = len(value[0].getPlainText())
+                else:
+                    continue
+                if size>longest[col][0]:
+                    longest[col] = (size, row)
+        rows.update([row for size, row in longest])
+        return sorted(rows)
+
+    def fix_widths(self, availWidth):
+        """Fix column widths from sampled rows, within availWidth.
+        """
+        least, most = [0]*self._ncols, [0]*self._ncols
+        spanned = ()
+        if self._spanCmds:
+            self._calcSpanRanges()
+            spanned = set(self._colSpanCells)
+        for row in self._sample():
+            values, styles = self._cellvalues[row], self._cellStyles[row]
+            for col in range(self._ncols):
+                if (col, row) in spanned:
+                    continue
+                low, high = cell_widths(values[col], styles[col],
+                                        (row, col) in self.plain_cells)
+                least[col] = max(least[col], low)
+                most[col] = max(most[col], high)
+        widths = share_width(least, most, availWidth)
+        self._argW = self._colWidths = widths
+        if self.plain_cells:
+            fit_plain_cells(self, self.plain_cells, widths,
+                            self.make_flowable)
+            self.plain_cells = {}
+
+    def wrap(self, availWidth, availHeight):
+        if None in self._argW:
+            self.fix_widths(availWidth)
+        return Table.wrap(self, availWidth, availHeight)
+
+
+class BoundTable(Flowable):
+    """Table whose rows are built from an iterable while laying out.
+
+    Rows are pulled from the iterable in chunks as frames are filled, so
+    only the rows of the current frame are held in memory. Static rows
+    come first; repeatRows of them are repeated on every frame.
+
+    Documents laid out more than once (for <pageCount/> or a table of
+    contents) iterate items again for each pass. items may be a callable
+    returning a fresh iterator for each pass; one-shot iterators (e.g.
+    generators) are recorded in full during the first pass instead, so
+    hold all their items in memory.
+
+    >>> fresh = BoundTable([], lambda: iter('ab'), list)
+    >>> once = BoundTable([], iter('ab'), list)
+    >>> fresh.rewind(True); once.rewind(True)
+    >>> fresh.recorded, once.recorded
+    (None, [])
+    """
+
+    def __init__(self, static_rows, items, row_template, colWidths=None,
+                 style=None, repeatRows=0, chunk_rows=100, **table_kwargs):
+        self.static_rows = static_rows
+        self.source = items
+        self.items = self._iterate()
+        self.recorded = None
+        self.row_template = row_template
+        self.colWidths = colWidths
+        self.repeatRows = repeatRows
+        commands = style and style.getCommands() or []
+        static_count = len(static_rows)
+        # styles of first chunk, of continued chunks and of bare data rows
+        self.first_style = commands
+        self.next_style = continuation_style(commands, static_count,
+                                             repeatRows)
+        self.data_style = continuation_style(commands, static_count, 0)
+        self.chunk_rows = chunk_rows
+        self.table_kwargs = table_kwargs
+        self.pending = deque()  # (row, height) pairs measured, not drawn
+        self.exhausted = False
+        self.started = False
+
+    def _make_table(self, rows, commands, row_heights=None):
+        table = Table(rows, colWidths=self.colWidths, rowHeights=row_heights,
+                      **self.table_kwargs)
+        if commands:
+            table.setStyle(commands)
+        return table
+
+    def _measure(self, rows, commands, availWidth):
+        """Measure row heights, fixing column widths on first call.
+        """
+        table = self._make_table(rows, commands)
+        table.wrap(availWidth, 0x7fffffff)
+        if self.colWidths is None:
+            self.colWidths = table._colWidths
+        return table._rowHeights
+
+    def _iterate(self):
+        if callable(self.source):
+            return iter(self.source())
+        return iter(self.source)
+
+    def _pull(self, availWidth):
+        """Pull and measure next chunk of rows from the iterable.
+        """
+        rows = []
+        for item in self.items:
+            if self.recorded is not None:
+                self.recorded.append(item)
+            rows.append(self.row_template(item))
+            if len(rows)>=self.chunk_rows:
+                break
+        else:
+            self.exhausted = True
+        if rows:
+            if self.colWidths is None:
+                # column widths are taken from static rows and first chunk
+                heights = self._measure(self.static_rows+rows,
+                                        self.first_style, availWidth)
+                heights = heights[len(self.static_rows):]
+            else:
+                heights = self._measure(rows, self.data_style, availWidth)
+            self.pending.extend(zip(rows, heights))
+
+    def rewind(self, record=False):
+        """Start over for another pass over the story.
+
+        Items of one-shot iterators are recorded while record is set, and
+        replayed by the next pass; callables give fresh ones instead.
+        """
+        if self.recorded is not None:
+            self.source = self.recorded
+        self.items = self._iterate()
+        self.recorded = None
+        if record and self.items is self.source:
+            self.recorded = []
+        self.pending.clear()
+        self.exhausted = False
+        self.started = False
+
+    def wrap(self, availWidth, availHeight):
+        # always ask to be split; split() builds table for available space.
+        self.width = availWidth
+        return (availWidth, availHeight+1)
+
+    def split(self, availWidth, availHeight):
+        if not self.pending and not self.exhausted:
+            self._pull(availWidth)
+        if self.started:
+            header, commands = self.static_rows[:self.repeatRows], self.next_style
+        else:
+            header, commands = self.static_rows, self.first_style
+        heights = []
+        if header:
+            heights = list(self._measure(header, commands, availWidth))
+        used = sum(heights)
+        rows = []
+        while True:
+            if not self.pending:
+                if self.exhausted:
+                    break
+                self._pull(availWidth)
+                continue
+            row, height = self.pending[0]
+            if used+height>availHeight:
+                break
+            self.pending.popleft()
+            rows.append(row)
+            heights.append(height)
+            used += height
+        if not rows:
+            if self.pending or (header and used>availHeight):
+                return [] # move on to next frame
+            if self.started or not header:
+                return [Spacer(0, 0)]
+        table = self._make_table(header+rows, commands, heights)
+        self.started = True
+        self.__dict__.pop('_postponed', None)
+        if self.pending or not self.exhausted:
+            return [table, self]
+        return [table]
+
+    def draw(self):
+        pass
+
+
+if __name__=="__main__":
+    from doctest import testmod
+    testmod()
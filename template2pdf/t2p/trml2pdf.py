@@ -20,30 +20,39 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import hashlib
+import re
 import sys
 import StringIO
 import xml.dom.minidom
+import xml.dom.pulldom
 import copy
 
 import reportlab
+import reportlab.lib.enums
+import reportlab.lib.styles
+import reportlab.lib.units
 from reportlab.pdfgen import canvas
-from reportlab import platypus
-
-try:
-    from reportlab.graphics.barcode.common import Codabar, Code11, I2of5, MSI
-    from reportlab.graphics.barcode.code128 import Code128
-    from reportlab.graphics.barcode.code39 import Standard39, Extended39
-    from reportlab.graphics.barcode.code93 import Standard93, Extended93
-    from reportlab.graphics.barcode.usps import FIM, POSTNET
-    barcode_codes = dict(codabar=Codabar, code11=Code11, code128=Code128,
-                 standard39=Standard39, extended39=Extended39, 
-                 standard93=Standard93, extended93=Extended93,
-                 i2of5=I2of5, msi=MSI, fim=FIM, postnet=POSTNET)
-except ImportError:
-    barcode_codes = {}
-    pass
-    
+
 import utils
+import output
+import overlay
+
+
+def _lazy_module(name):
+    """Module name of ReportLab or next to this one, imported on first use.
+    """
+    package = __name__.rpartition('.')[0]
+    if not name.startswith('reportlab.') and package:
+        name = package+'.'+name
+    return utils.LazyModule(name)
+
+# modules loading most of ReportLab, which documents may not need
+platypus = _lazy_module('reportlab.platypus')
+barcodes = _lazy_module('barcodes')
+charts = _lazy_module('charts')
+layout = _lazy_module('layout')
+tables = _lazy_module('tables')
 
 
 #
@@ -52,6 +61,84 @@ import utils
 encoding = 'utf-8'
 
 
+_shape_attrs = {'fill': 'bool', 'stroke': 'bool'}
+_para_attrs = {'bulletText': 'str'}
+
+# attribute schemas for each element, keyed by tag name
+attr_schemas = dict(
+    drawString=utils.AttrSchema(['x', 'y']),
+    drawCentredString=utils.AttrSchema(['x', 'y']),
+    drawRightString=utils.AttrSchema(['x', 'y']),
+    rect=utils.AttrSchema(['x', 'y', 'width', 'height'], _shape_attrs),
+    ellipse=utils.AttrSchema(['x', 'y', 'width', 'height'], _shape_attrs),
+    circle=utils.AttrSchema(['x', 'y', 'radius'], _shape_attrs),
+    path=utils.AttrSchema(['x', 'y'], _shape_attrs),
+    place=utils.AttrSchema(['x', 'y', 'width', 'height']),
+    para=utils.AttrSchema([], _para_attrs),
+    title=utils.AttrSchema([], _para_attrs),
+    h1=utils.AttrSchema([], _para_attrs),
+    h2=utils.AttrSchema([], _para_attrs),
+    h3=utils.AttrSchema([], _para_attrs),
+    xpre=utils.AttrSchema([], {'bulletText': 'str', 'dedent': 'int',
+                               'frags': 'int'}),
+    pre=utils.AttrSchema([], {'bulletText': 'str', 'dedent': 'int'}),
+    image=utils.AttrSchema(['width', 'height']),
+    condPageBreak=utils.AttrSchema(['height']),
+    blockTable=utils.AttrSchema(['splitByRow'],
+                                {'repeatRows': 'int', 'repeatCols': 'int'}),
+    barCode=utils.AttrSchema([],
+                             {'barWidth': 'pt', 'barHeight': 'pt',
+                              'fontName': 'text', 'fontSize': 'pt',
+                              'humanReadable': 'bool'}),
+    template=utils.AttrSchema(['leftMargin', 'rightMargin', 'topMargin',
+                               'bottomMargin'],
+                              {'allowSplitting': 'int', 'showBoundary': 'bool',
+                               'title': 'str', 'author': 'str'}),
+    pageTemplate=utils.AttrSchema([], {'id': 'str'}),
+    frame=utils.AttrSchema(['x1', 'y1', 'width', 'height', 'leftPadding',
+                            'rightPadding', 'bottomPadding', 'topPadding'],
+                           {'id': 'text', 'showBoundary': 'bool'}),
+    labelSheet=utils.AttrSchema(['x', 'y', 'width', 'height', 'colGap',
+                                 'rowGap'],
+                                {'rows': 'int', 'cols': 'int',
+                                 'showBoundary': 'bool'}),
+    lineChart=utils.AttrSchema(['x', 'y']),
+    barChart=utils.AttrSchema(['x', 'y']),
+    scatterChart=utils.AttrSchema(['x', 'y']),
+    )
+
+
+def _attrs(node):
+    """Decodes node attributes with the schema declared for its tag.
+    """
+    return attr_schemas[node.localName](node)
+
+
+def _page_size(node, default=('21cm', '29.7cm')):
+    """Page size from pageSize attribute, e.g. "(595, 842)".
+    """
+    if node.hasAttribute('pageSize'):
+        ps = map(lambda x:x.strip(),
+                 (node.getAttribute('pageSize').replace(')', '')
+                  .replace('(', '').split(',')))
+    else:
+        ps = default
+    return (utils.as_pt(ps[0]), utils.as_pt(ps[1]))
+
+
+sample_styles = None
+
+def get_sample_styles():
+    """ReportLab sample stylesheet, built on first use only.
+
+    Styles are shared, so they are copied before being modified.
+    """
+    global sample_styles
+    if sample_styles is None:
+        sample_styles = reportlab.lib.styles.getSampleStyleSheet()
+    return sample_styles
+
+
 def _child_get(node, childs):
     """Filter child nodes
     """
@@ -65,6 +152,8 @@ class _rml_styles(object):
         self.styles = {}
         self.names = {}
         self.table_styles = {}
+        # styles of <para> in table cells, by attributes
+        self.cell_styles = {}
         for node in nodes:
             for style in node.getElementsByTagName('blockTableStyle'):
                 self.table_styles[style.getAttribute('id')] = self._table_style_get(style)
@@ -148,7 +237,7 @@ class _rml_styles(object):
         return platypus.tables.TableStyle(styles)
 
     def _para_style_get(self, node):
-        styles = reportlab.lib.styles.getSampleStyleSheet()
+        styles = get_sample_styles()
         style = copy.deepcopy(styles["Normal"])
         self._para_style_update(style, node)
         return style
@@ -162,10 +251,20 @@ class _rml_styles(object):
                 sys.stderr.write('Warning: style not found, %s - setting default!\n'
                                  %(node.getAttribute('style')))
         if not style:
-            styles = reportlab.lib.styles.getSampleStyleSheet()
+            styles = get_sample_styles()
             style = copy.deepcopy(styles['Normal'])
         return self._para_style_update(style, node)
 
+    def cell_style_get(self, node):
+        """Style of <para> in a table cell, shared by cells with the same
+        attributes rather than copied for each.
+        """
+        key = tuple(sorted(node.attributes.items()))
+        style = self.cell_styles.get(key)
+        if style is None:
+            style = self.cell_styles[key] = self.para_style_get(node)
+        return style
+
 
 FONT_CACHE = {}
 
@@ -211,12 +310,128 @@ def default_image_resolver(node):
     return img, args
 
 
+# found at least once for each <pageDrawing> element, so documents with
+# fewer matches need not be scanned (see _scan_children)
+regex_drawing = re.compile(r'<pageDrawing\b')
+
+
+def _scan_children(data):
+    """Scan the children of the root element of document data, without
+    keeping their nodes.
+
+    Returns the local names of children before the first <pageDrawing>,
+    the number of <pageDrawing> children, and the local names of other
+    children after the first <pageDrawing>.
+    """
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    before, count, after = [], 0, []
+    depth = 0
+    for event, node in xml.dom.pulldom.parse(StringIO.StringIO(data)):
+        if event==xml.dom.pulldom.START_ELEMENT:
+            depth += 1
+            if depth==2:
+                if node.localName=='pageDrawing':
+                    count += 1
+                elif count:
+                    after.append(node.localName)
+                else:
+                    before.append(node.localName)
+        elif event==xml.dom.pulldom.END_ELEMENT:
+            depth -= 1
+    return before, count, after
+
+
+def _parse_drawings(data):
+    """Parse canvas document data, up to its first <pageDrawing>.
+
+    Returns the document and an iterator of its <pageDrawing> elements,
+    each parsed when reached. Nodes are not attached to the document, so
+    they are released once dropped. Elements other than <pageDrawing>
+    must all come before the first <pageDrawing>; ValueError is raised
+    when one is reached after it (_rml_doc parses such documents as a
+    whole, see _scan_children).
+    """
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    events = xml.dom.pulldom.parse(StringIO.StringIO(data))
+    dom = first = None
+    depth = 0
+    for event, node in events:
+        if event==xml.dom.pulldom.START_DOCUMENT:
+            dom = node
+        elif event==xml.dom.pulldom.START_ELEMENT:
+            depth += 1
+            if depth==2:
+                if node.localName=='pageDrawing':
+                    first = node
+                    break
+                events.expandNode(node)
+                dom.documentElement.appendChild(node)
+                depth -= 1
+        elif event==xml.dom.pulldom.END_ELEMENT:
+            depth -= 1
+    def drawings(node):
+        while node is not None:
+            events.expandNode(node)
+            yield node
+            node = None
+            # elements reached are children of the root element, as those
+            # before them were expanded
+            for event, node in events:
+                if event==xml.dom.pulldom.START_ELEMENT:
+                    if node.localName!='pageDrawing':
+                        raise ValueError('<%s> after <pageDrawing> in a '
+                                         'streamed document' %(node.localName))
+                    break
+            else:
+                node = None
+    return dom, drawings(first)
+
+
 class _rml_doc(object):
-    def __init__(self, data, font_resolver=None, image_resolver=None):
-        self.dom = xml.dom.minidom.parseString(data)
+    def __init__(self, data, font_resolver=None, image_resolver=None,
+                 sources=None):
+        # <pageDrawing> elements of canvas documents, parsed while rendering
+        self.drawings = None
+        if isinstance(data, basestring):
+            if isinstance(data, unicode):
+                self.digest = hashlib.md5(data.encode('utf-8')).hexdigest()
+            else:
+                self.digest = hashlib.md5(data).hexdigest()
+            # canvas documents of several pages are drawn as parsed,
+            # provided other elements (e.g. <stylesheet>, which applies to
+            # all pages) come before the pages
+            self.drawing_count = None
+            if len(regex_drawing.findall(data))>1:
+                before, count, after = _scan_children(data)
+                if count>1 and not after and 'template' not in before:
+                    self.drawing_count = count
+            if self.drawing_count:
+                self.dom, self.drawings = _parse_drawings(data)
+            else:
+                self.dom = xml.dom.minidom.parseString(data)
+        else:
+            # chunks (e.g. of template output), parsed as they are produced;
+            # keys of <static> nodes are then taken from the nodes
+            reader = utils.ChunkReader(data)
+            self.dom = xml.dom.minidom.parse(reader)
+            self.digest = reader.digest.hexdigest()
+            self.drawing_count = None
+            data = ''
         self.filename = self.dom.documentElement.getAttribute('filename')
         self.font_resolver = font_resolver or default_font_resolver
         self.image_resolver = image_resolver or default_image_resolver
+        # named Python objects elements may refer to (e.g. chart series)
+        self.sources = sources or {}
+        # known after layout pass, for <pageCount/>
+        self.page_count = None
+        # cache keys of <static> nodes
+        self.static_keys = overlay.static_keys(data, self.dom)
+        # compression options and (seed, timestamp) fixing dates and ID of
+        # output, see render()
+        self.options = None
+        self.fixed = None
 
     def docinit(self, els):
         from reportlab.lib.fonts import addMapping
@@ -249,7 +464,83 @@ class _rml_doc(object):
                 if font:
                     pdfmetrics.registerFont(font)
 
-    def render(self, out):
+    def render(self, out, pages=None, max_pages=None, max_bytes=None,
+               linearize=False, profile=None, deterministic=False,
+               timestamp=None):
+        """Render PDF into out.
+
+        pages limits output to a number of leading pages or to a (first,
+        last) range of them (see layout.page_range).
+
+        With max_pages or max_bytes, output is split into files named by
+        out, a pattern formatted with the part number, and the list of
+        files written is returned (see layout.RollingCanvas).
+
+        With linearize, PDF is linearized for viewers to show the first
+        page early (see output.linearize).
+
+        profile names output options trading render time for file size:
+        fast, default or small (see output.PROFILES).
+
+        With deterministic, the same input gives the same bytes: dates are
+        at timestamp (seconds since the epoch, by default that of
+        ReportLab's invariant mode), and the document ID is derived from
+        deterministic, or from a digest of the RML if it is True. Fonts,
+        images and sources are not part of the digest; pass a value
+        covering them where they change.
+        """
+        pages = layout.page_range(pages)
+        if deterministic is True:
+            self.fixed = (self.digest, timestamp)
+        elif deterministic:
+            self.fixed = (str(deterministic), timestamp)
+        else:
+            self.fixed = None
+        self.options = output.get_profile(profile)
+        rewrite = self.options.get('rewrite')
+        if max_pages or max_bytes:
+            if pages:
+                raise ValueError('pages can not be combined with split output')
+            if linearize:
+                raise ValueError('split output can not be linearized')
+            def canvasmaker(filename, **kw):
+                return layout.RollingCanvas(filename, max_pages, max_bytes,
+                                            **kw)
+            filenames = self._render(out, pages, canvasmaker).filenames
+            if rewrite:
+                for filename in filenames:
+                    output.rewrite_file(filename, rewrite)
+            return filenames
+        canvasmaker = canvas.Canvas
+        if self.drawings is not None:
+            # pages parsed as they are drawn are written out as drawn
+            canvasmaker = layout.StreamingCanvas
+        if not (linearize or rewrite):
+            self._render(out, pages, canvasmaker)
+            return None
+        buf = StringIO.StringIO()
+        self._render(buf, pages, canvasmaker)
+        pdf = buf.getvalue()
+        if rewrite:
+            pdf = output.rewrite(pdf, rewrite)
+        if linearize:
+            pdf = output.linearize(pdf)
+        if isinstance(out, basestring):
+            out = file(out, 'wb')
+            out.write(pdf)
+            out.close()
+        else:
+            out.write(pdf)
+        return None
+
+    def render_on(self, canv):
+        """Render onto canv, shared with documents rendered before and
+        after, without saving it. Page numbers start from 1 again.
+        """
+        canv._pageNumber = 1
+        self._render(None, None, lambda *args, **kw: canv, save=False)
+
+    def _render(self, out, pages, canvasmaker, save=True):
         el = self.dom.documentElement.getElementsByTagName('docinit')
         if el:
             self.docinit(el)
@@ -260,14 +551,60 @@ class _rml_doc(object):
         el = self.dom.documentElement.getElementsByTagName('template')
         if len(el):
             pt_obj = _rml_template(out, el[0], self)
-            pt_obj.render(self.dom.documentElement.getElementsByTagName('story')[0])
+            return pt_obj.render(
+                self.dom.documentElement.getElementsByTagName('story')[0],
+                pages, canvasmaker, save)
         else:
-            self.canvas = canvas.Canvas(out)
-            pd = self.dom.documentElement.getElementsByTagName('pageDrawing')[0]
-            pd_obj = _rml_canvas(self.canvas, doc_tmpl=None, doc=self)
-            pd_obj.render(pd)
+            if pages:
+                self.canvas = layout.PreviewCanvas(out, first_page=pages[0])
+            else:
+                self.canvas = canvasmaker(out)
+            if self.options:
+                output.apply_options(self.canvas, self.options)
+            if self.fixed:
+                output.fix_document(self.canvas, *self.fixed)
+            sheet = self.dom.documentElement.getElementsByTagName('labelSheet')
+            if sheet:
+                _rml_label_sheet(self.canvas, sheet[0], self).render()
+                self.canvas.showPage()
+                layout.pack_page(self.canvas)
+            else:
+                self._render_drawings(pages)
+            if save:
+                self.canvas.save()
+            return self.canvas
+
+
+    def _render_drawings(self, pages=None):
+        """Draw each <pageDrawing> as a page.
+
+        Once its page is drawn, the content of the page is compressed (and
+        written out, on a layout.StreamingCanvas) and the nodes of the
+        <pageDrawing> are released, so rendering a document consumes it.
+        """
+        drawings = self.drawings
+        if drawings is None:
+            drawings = self.dom.documentElement.getElementsByTagName(
+                'pageDrawing')
+            self.drawing_count = len(drawings)
+            drawings = iter(drawings)
+        self.page_count = self.drawing_count
+        last = pages and pages[1]
+        pd_obj = _rml_canvas(self.canvas, doc_tmpl=None, doc=self)
+        for pd in drawings:
+            if not getattr(self.canvas, 'layout_only', False):
+                pd_obj.render(pd)
+            self.canvas.showPage()
+            layout.pack_page(self.canvas)
+            for node in pd.getElementsByTagName('static'):
+                self.static_keys.pop(node, None)
+            if pd.parentNode is not None:
+                pd.parentNode.removeChild(pd)
+            pd.unlink()
+            if last and self.canvas.getPageNumber()>last:
+                break
+        if not self.page_count:
             self.canvas.showPage()
-            self.canvas.save()
 
 
 class _rml_canvas(object):
@@ -276,6 +613,8 @@ class _rml_canvas(object):
         self.styles = doc.styles
         self.doc_tmpl = doc_tmpl
         self.doc = doc
+        # fields of record for %(field)s in text, when drawing labels
+        self.record = None
         self.init_tag_handlers()
 
     def _textual(self, node):
@@ -284,56 +623,47 @@ class _rml_canvas(object):
             if n.nodeType == n.ELEMENT_NODE:
                 if n.localName=='pageNumber':
                     rc += str(self.canvas.getPageNumber())
+                elif n.localName=='pageCount':
+                    rc += str(self.doc.page_count or 0)
             elif (n.nodeType == node.CDATA_SECTION_NODE):
                 rc += n.data
             elif (n.nodeType == node.TEXT_NODE):
                 rc += n.data
+        if self.record is not None:
+            rc = tables.fill_fields(rc, self.record)
         return rc.encode(encoding)
 
     def _drawString(self, node):
         self.canvas.drawString(
-            text=self._textual(node), **utils.getAttrsAsDict(node, ['x', 'y']))
+            text=self._textual(node), **_attrs(node))
     def _drawCenteredString(self, node):
         self.canvas.drawCentredString(
-            text=self._textual(node), **utils.getAttrsAsDict(node, ['x', 'y']))
+            text=self._textual(node), **_attrs(node))
     def _drawRightString(self, node):
         self.canvas.drawRightString(
-            text=self._textual(node), **utils.getAttrsAsDict(node, ['x', 'y']))
+            text=self._textual(node), **_attrs(node))
     def _rect(self, node):
         if node.hasAttribute('round'):
             self.canvas.roundRect(
-                radius=utils.as_pt(node.getAttribute('round')),
-                **utils.getAttrsAsDict(node,
-                                       ['x', 'y', 'width', 'height'],
-                                       {'fill': 'bool', 'stroke': 'bool'}))
+                radius=utils.as_pt(node.getAttribute('round')), **_attrs(node))
         else:
-            self.canvas.rect(
-                **utils.getAttrsAsDict(node,
-                                       ['x', 'y', 'width', 'height'],
-                                       {'fill': 'bool', 'stroke': 'bool'}))
+            self.canvas.rect(**_attrs(node))
     def _ellipse(self, node):
-        x1 = utils.as_pt(node.getAttribute('x'))
-        x2 = utils.as_pt(node.getAttribute('width'))
-        y1 = utils.as_pt(node.getAttribute('y'))
-        y2 = utils.as_pt(node.getAttribute('height'))
+        attrs = _attrs(node)
         self.canvas.ellipse(
-            x1, y1, x2, y2,
-            **utils.getAttrsAsDict(node, [], {'fill': 'bool', 'stroke': 'bool'}))
+            attrs.pop('x'), attrs.pop('y'),
+            attrs.pop('width'), attrs.pop('height'), **attrs)
 
     def _curves(self, node):
-        line_str = utils.getText(node).split()
-        lines = []
-        while len(line_str)>7:
-            self.canvas.bezier(*[utils.as_pt(l) for l in line_str[0:8]])
-            line_str = line_str[8:]
+        path = self.canvas.beginPath()
+        for x1, y1, x2, y2, x3, y3, x4, y4 in utils.as_pt_tuples(
+            utils.getText(node), 8):
+            path.moveTo(x1, y1)
+            path.curveTo(x2, y2, x3, y3, x4, y4)
+        self.canvas.drawPath(path, stroke=1, fill=0)
 
     def _lines(self, node):
-        line_str = utils.getText(node).split()
-        lines = []
-        while len(line_str)>3:
-            lines.append([utils.as_pt(l) for l in line_str[0:4]])
-            line_str = line_str[4:]
-        self.canvas.lines(lines)
+        self.canvas.lines(utils.as_pt_tuples(utils.getText(node), 4))
 
     def _grid(self, node):
         xlist = [utils.as_pt(s) for s in node.getAttribute('xs').split(',')]
@@ -350,15 +680,14 @@ class _rml_canvas(object):
         self.canvas.translate(dx,dy)
 
     def _circle(self, node):
+        attrs = _attrs(node)
         self.canvas.circle(
-            x_cen=utils.as_pt(node.getAttribute('x')),
-            y_cen=utils.as_pt(node.getAttribute('y')),
-            r=utils.as_pt(node.getAttribute('radius')),
-            **utils.getAttrsAsDict(node, [], {'fill': 'bool', 'stroke': 'bool'}))
+            x_cen=attrs.pop('x'), y_cen=attrs.pop('y'), r=attrs.pop('radius'),
+            **attrs)
 
     def _place(self, node):
         flows = _rml_flowable(self.doc).render(node)
-        infos = utils.getAttrsAsDict(node, ['x', 'y', 'width', 'height'])
+        infos = _attrs(node)
 
         infos['y']+=infos['height']
         for flow in flows:
@@ -393,33 +722,53 @@ class _rml_canvas(object):
         y = args.pop('y', 0)
         self.canvas.drawImage(img, x, y, **args)
 
+    def _chart(self, node):
+        from reportlab.graphics import renderPDF
+        attrs = _attrs(node)
+        drawing = charts.chart_drawing(node, self.doc.sources)
+        renderPDF.draw(drawing, self.canvas, attrs['x'], attrs['y'])
+
     def _path(self, node):
+        attrs = _attrs(node)
         self.path = self.canvas.beginPath()
-        self.path.moveTo(**utils.getAttrsAsDict(node, ['x', 'y']))
+        self.path.moveTo(attrs.pop('x'), attrs.pop('y'))
         for n in node.childNodes:
             if n.nodeType == node.ELEMENT_NODE:
                 if n.localName=='moveto':
-                    vals = utils.getText(n).split()
-                    self.path.moveTo(utils.as_pt(vals[0]), utils.as_pt(vals[1]))
+                    vals = utils.as_pt_list(utils.getText(n))
+                    self.path.moveTo(vals[0], vals[1])
                 elif n.localName=='curvesto':
-                    vals = utils.getText(n).split()
-                    while len(vals)>5:
-                        pos=[]
-                        while len(pos)<6:
-                            pos.append(utils.as_pt(vals.pop(0)))
-                        self.path.curveTo(*pos)
+                    curve_to = self.path.curveTo
+                    for pos in utils.as_pt_tuples(utils.getText(n), 6):
+                        curve_to(*pos)
             elif (n.nodeType == node.TEXT_NODE):
-                data = n.data.split()    # Not sure if I must merge all TEXT_NODE ?
-                while len(data)>1:
-                    x = utils.as_pt(data.pop(0))
-                    y = utils.as_pt(data.pop(0))
-                    self.path.lineTo(x, y)
+                # Not sure if I must merge all TEXT_NODE ?
+                line_to = self.path.lineTo
+                for x, y in utils.as_pt_tuples(n.data, 2):
+                    line_to(x, y)
         if ((not node.hasAttribute('close'))
             or utils.as_bool(node.getAttribute('close'))):
             self.path.close()
-        self.canvas.drawPath(
-            self.path,
-            **utils.getAttrsAsDict(node, [], {'fill':'bool','stroke':'bool'}))
+        self.canvas.drawPath(self.path, **attrs)
+
+    def _barcode(self, node):
+        if barcodes.get_code(node.getAttribute('code')) is None:
+            return
+        pattern = barcodes.get_pattern(node.getAttribute('code'),
+                                       self._textual(node), _attrs(node))
+        self.canvas.saveState()
+        self.canvas.translate(utils.as_pt(node.getAttribute('x') or '0'),
+                              utils.as_pt(node.getAttribute('y') or '0'))
+        barcodes.draw_pattern(self.canvas, pattern)
+        self.canvas.restoreState()
+
+    def _static(self, node):
+        key = self.doc.static_keys.get(node)
+        if key is None:
+            key = self.doc.static_keys[node] = overlay.static_key(node)
+        def draw(canv):
+            _rml_canvas(canv, self.doc_tmpl, self.doc).render(node)
+        overlay.draw_static(self.canvas, node, draw, key)
 
     def init_tag_handlers(self):
         self.tag_handlers = {
@@ -440,26 +789,87 @@ class _rml_canvas(object):
             'path': self._path,
             'rotate': lambda node: self.canvas.rotate(float(node.getAttribute('degrees'))),
             'translate': self._translate,
-            'image': self._image
+            'image': self._image,
+            'lineChart': self._chart,
+            'barChart': self._chart,
+            'scatterChart': self._chart,
+            'static': self._static,
+            'barCode': self._barcode,
         }
 
-    def render(self, node):
+    def compile(self, node):
+        """Compile children of drawing node into (handler, node) pairs.
+        """
+        ops = []
         for nd in node.childNodes:
             if nd.nodeType==nd.ELEMENT_NODE:
-                for tag in self.tag_handlers:
-                    if nd.localName==tag:
-                        self.tag_handlers[tag](nd)
-                        break
+                handler = self.tag_handlers.get(nd.localName)
+                if handler:
+                    ops.append((handler, nd))
+        return ops
+
+    def render(self, node):
+        for handler, nd in self.compile(node):
+            handler(nd)
+
+
+class _rml_label_sheet(object):
+    """Draws records into a grid of cells (labels, badges...) on pages.
+
+    Children of <labelSheet> are compiled once and replayed for each
+    record of its source, translated to the cell; %(field)s in their text
+    is replaced with fields of the record. Cells are filled from the top
+    row, left to right; (x, y) is the lower left corner of the grid.
+    """
+
+    def __init__(self, canvas, node, doc):
+        self.canvas = canvas
+        self.node = node
+        self.doc = doc
+
+    def cells(self):
+        attrs = _attrs(self.node)
+        rows, cols = attrs.get('rows', 1), attrs.get('cols', 1)
+        step_x = attrs['width']+attrs['colGap']
+        step_y = attrs['height']+attrs['rowGap']
+        return [(attrs['x']+col*step_x, attrs['y']+(rows-1-row)*step_y)
+                for row in range(rows) for col in range(cols)]
+
+    def render(self):
+        attrs = _attrs(self.node)
+        self.canvas.setPageSize(_page_size(self.node))
+        cnv = _rml_canvas(self.canvas, None, self.doc)
+        ops = cnv.compile(self.node)
+        cells = self.cells()
+        records = self.doc.sources[self.node.getAttribute('source')]
+        index = 0
+        for record in records:
+            if index==len(cells):
+                self.canvas.showPage()
+                index = 0
+            x, y = cells[index]
+            index += 1
+            self.canvas.saveState()
+            self.canvas.translate(x, y)
+            if attrs.get('showBoundary'):
+                self.canvas.rect(0, 0, attrs['width'], attrs['height'])
+            cnv.record = record
+            for handler, nd in ops:
+                handler(nd)
+            self.canvas.restoreState()
 
 class _rml_draw(object):
-    def __init__(self, node, styles):
+    def __init__(self, node, styles, doc=None):
         self.node = node
         self.styles = styles
+        self.doc = doc
         self.canvas = None
 
     def render(self, canvas, doc):
+        if getattr(canvas, 'layout_only', False):
+            return # page graphics do not affect layout
         canvas.saveState()
-        cnv = _rml_canvas(canvas, None, doc)
+        cnv = _rml_canvas(canvas, None, self.doc or doc)
         cnv.render(self.node)
         canvas.restoreState()
 
@@ -477,6 +887,9 @@ class _rml_flowable(object):
                         self.styles.names.get(n.getAttribute('id'),'Unknown name'))
                     node.insertBefore(newNode, n)
                     node.removeChild(n)
+                if n.localName=='pageCount':
+                    rc += layout.PAGE_COUNT
+                    continue
                 if n.localName=='pageNumber':
                     rc+='<pageNumber/>'            # TODO: change this !
                 else:
@@ -493,13 +906,26 @@ class _rml_flowable(object):
         colwidths = None
         rowheights = None
         data = []
+        # (row, col) -> (node, style) of cells holding a single <para> of
+        # plain text, drawn as strings where the text fits on a line
+        plain = {}
         for tr in _child_get(node,'tr'):
             data2 = []
             for td in _child_get(tr, 'td'):
                 flow = []
                 for n in td.childNodes:
                     if n.nodeType==node.ELEMENT_NODE:
-                        flow.append( self._flowable(n) )
+                        flow.append(n)
+                if len(flow)==1 and flow[0].localName=='para':
+                    style = self.styles.cell_style_get(flow[0])
+                    text = tables.plain_text(self._textual(flow[0]), style)
+                    if text is not None:
+                        plain[(len(data), len(data2))] = (flow[0], style)
+                        data2.append(text)
+                        continue
+                    flow = [self._paragraph(flow[0], style)]
+                else:
+                    flow = [self._flowable(n) for n in flow]
                 if not len(flow):
                     flow = self._textual(td)
                 data2.append( flow )
@@ -511,22 +937,68 @@ class _rml_flowable(object):
             while len(data2)<length:
                 data2.append('')
             data.append( data2 )
-        if node.hasAttribute('colWidths'):
+        row_tmpl = _child_get(node, 'rowTemplate')
+        if row_tmpl:
+            row_template = self._row_template(row_tmpl[0])
+            length = max(length, len(row_template.cells))
+            for ab in data:
+                while len(ab)<length:
+                    ab.append('')
+        # auto: widths taken from a sample of rows
+        auto = node.getAttribute('colWidths')=='auto'
+        if node.hasAttribute('colWidths') and not auto:
             assert length == len(node.getAttribute('colWidths').split(','))
             colwidths = [utils.as_pt(f.strip())
                          for f in node.getAttribute('colWidths').split(',')]
         if node.hasAttribute('rowHeights'):
             rowheights = [utils.as_pt(f.strip())
                           for f in node.getAttribute('rowHeights').split(',')]
-        table = platypus.Table(
-            data=data, colWidths=colwidths, rowHeights=rowheights,
-            **(utils.getAttrsAsDict(node,
-                                    ['splitByRow'],
-                                    {'repeatRows':'int','repeatCols':'int'})))
+        style = None
         if node.hasAttribute('style'):
-            table.setStyle(self.styles.table_styles[node.getAttribute('style')])
+            style = self.styles.table_styles[node.getAttribute('style')]
+        if row_tmpl or not (colwidths or auto):
+            for (row, col), (para, para_style) in plain.items():
+                data[row][col] = [self._paragraph(para, para_style)]
+            plain = {}
+        if row_tmpl:
+            # rows are built from the bound iterable while laying out;
+            # without colWidths, widths are taken from the first chunk
+            source = self.doc.sources[row_tmpl[0].getAttribute('source')]
+            chunk_rows = int(row_tmpl[0].getAttribute('chunkRows') or 100)
+            return tables.BoundTable(data, source, row_template,
+                                     colWidths=colwidths, style=style,
+                                     chunk_rows=chunk_rows, **_attrs(node))
+        if auto:
+            table = tables.AutoWidthTable(
+                data=data, rowHeights=rowheights, normalizedData=1,
+                **_attrs(node))
+            if node.hasAttribute('sampleRows'):
+                table.sample_rows = int(node.getAttribute('sampleRows'))
+        else:
+            table = platypus.Table(
+                data=data, colWidths=colwidths, rowHeights=rowheights,
+                normalizedData=1, **_attrs(node))
+        if style:
+            table.setStyle(style)
+        if plain:
+            table.setStyle(tables.plain_cell_commands(
+                dict([(cell, para_style)
+                      for cell, (para, para_style) in plain.items()])))
+            # cells are measured once table style is applied
+            if auto:
+                table.plain_cells = plain
+                table.make_flowable = self._paragraph
+            else:
+                tables.fit_plain_cells(table, plain, colwidths,
+                                       self._paragraph)
         return table
 
+    def _row_template(self, node):
+        cells = [(str(td.getAttribute('field')),
+                  td.getAttribute('format') or None)
+                 for td in _child_get(node, 'td')]
+        return tables.RowTemplate(cells)
+
     def _illustration(self, node):
         class Illustration(platypus.flowables.Flowable):
             def __init__(self, node, styles, parent):
@@ -543,57 +1015,62 @@ class _rml_flowable(object):
                 drw.render(self.canv, self.parent.doc)
         return Illustration(node, self.styles, self)
 
+    def _paragraph(self, node, style, toc_level=None):
+        text = self._textual(node)
+        if layout.PAGE_COUNT in text:
+            flow = layout.DeferredParagraph(text, style, counter=self.doc,
+                                            **_attrs(node))
+        else:
+            flow = layout.Paragraph(text, style, **_attrs(node))
+        flow._toc_level = toc_level
+        return flow
+
     def _flowable(self, node):
         if node.localName=='para':
             style = self.styles.para_style_get(node)
-            return platypus.Paragraph(
-                self._textual(node), style,
-                **(utils.getAttrsAsDict(node, [], {'bulletText':'str'})))
+            return self._paragraph(node, style)
         elif node.localName=='name':
             self.styles.names[ node.getAttribute('id')] = node.getAttribute('value')
             return None
-        elif node.localName=='xpre':
-            style = self.styles.para_style_get(node)
-            return platypus.XPreformatted(
-                self._textual(node), style,
-                **(utils.getAttrsAsDict(node, [], {'bulletText':'str','dedent':'int','frags':'int'})))
-        elif node.localName=='pre':
+        elif node.localName in ('xpre', 'pre'):
             style = self.styles.para_style_get(node)
-            return platypus.Preformatted(
-                self._textual(node), style,
-                **(utils.getAttrsAsDict(node, [], {'bulletText':'str','dedent':'int'})))
+            attrs = _attrs(node)
+            if node.localName=='xpre':
+                make = lambda text: platypus.XPreformatted(text, style,
+                                                           **attrs)
+            else:
+                make = lambda text: platypus.Preformatted(text, style,
+                                                          **attrs)
+            text = self._textual(node)
+            if layout.PAGE_COUNT in text:
+                return layout.DeferredFlowable(text, make, self.doc)
+            return make(text)
         elif node.localName=='illustration':
             return  self._illustration(node)
         elif node.localName=='blockTable':
             return  self._table(node)
+        elif node.localName in ('lineChart', 'barChart', 'scatterChart'):
+            return charts.chart_drawing(node, self.doc.sources)
         elif node.localName=='title':
-            styles = reportlab.lib.styles.getSampleStyleSheet()
+            styles = get_sample_styles()
             style = styles['Title']
-            return platypus.Paragraph(
-                self._textual(node), style,
-                **(utils.getAttrsAsDict(node, [], {'bulletText':'str'})))
+            return self._paragraph(node, style)
         elif node.localName=='h1':
-            styles = reportlab.lib.styles.getSampleStyleSheet()
+            styles = get_sample_styles()
             style = styles['Heading1']
-            return platypus.Paragraph(
-                self._textual(node), style,
-                **(utils.getAttrsAsDict(node, [], {'bulletText':'str'})))
+            return self._paragraph(node, style, 0)
         elif node.localName=='h2':
-            styles = reportlab.lib.styles.getSampleStyleSheet()
+            styles = get_sample_styles()
             style = styles['Heading2']
-            return platypus.Paragraph(
-                self._textual(node), style,
-                **(utils.getAttrsAsDict(node, [], {'bulletText':'str'})))
+            return self._paragraph(node, style, 1)
         elif node.localName=='h3':
-            styles = reportlab.lib.styles.getSampleStyleSheet()
+            styles = get_sample_styles()
             style = styles['Heading3']
-            return platypus.Paragraph(
-                self._textual(node), style,
-                **(utils.getAttrsAsDict(node, [], {'bulletText':'str'})))
+            return self._paragraph(node, style, 2)
         elif node.localName=='image':
             return platypus.Image(
                 node.getAttribute('file'), mask=(250, 255, 250, 255, 250, 255),
-                **(utils.getAttrsAsDict(node, ['width','height'])))
+                **_attrs(node))
         elif node.localName=='spacer':
             if node.hasAttribute('width'):
                 width = utils.as_pt(node.getAttribute('width'))
@@ -601,55 +1078,45 @@ class _rml_flowable(object):
                 width = utils.as_pt('1cm')
             length = utils.as_pt(node.getAttribute('length'))
             return platypus.Spacer(width=width, height=length)
+        elif node.localName=='tableOfContents':
+            from reportlab.platypus.tableofcontents import TableOfContents
+            return TableOfContents()
         elif node.localName=='pageBreak':
             return platypus.PageBreak()
         elif node.localName=='condPageBreak':
-            return platypus.CondPageBreak(**(utils.getAttrsAsDict(node, ['height'])))
+            return platypus.CondPageBreak(**_attrs(node))
         elif node.localName=='setNextTemplate':
             return platypus.NextPageTemplate(str(node.getAttribute('name')))
         elif node.localName=='nextFrame':
             return platypus.CondPageBreak(1000)           # TODO: change the 1000 !
-        elif barcode_codes and node.localName=='barCode':
-            code = barcode_codes.get(node.getAttribute('code'), Code128)
-            attr_types = {'barWidth': 'pt', 'barHeight': 'pt',
-                          'fontName': 'text', 'fontSize': 'pt',
-                          'humanReadable': 'bool'}
-            return code(
-                self._textual(node),
-                **utils.getAttrsAsDict(node, ['barWidth', 'barHeight'], attr_types))
+        elif (node.localName=='barCode'
+              and barcodes.get_code(node.getAttribute('code')) is not None):
+            return barcodes.BarcodeFlowable(barcodes.get_pattern(
+                node.getAttribute('code'), self._textual(node), _attrs(node)))
         else:
             sys.stderr.write('Warning: flowable not yet implemented: %s !\n' % (node.localName,))
             return None
 
-    def render(self, node_story):
-        story = []
+    def iter_render(self, node_story):
         node = node_story.firstChild
         while node:
             if node.nodeType == node.ELEMENT_NODE:
                 flow = self._flowable(node) 
                 if flow:
-                    story.append(flow)
+                    yield flow
             node = node.nextSibling
-        return story
+
+    def render(self, node_story):
+        return list(self.iter_render(node_story))
 
 class _rml_template(object):
     def __init__(self, out, node, doc):
-        if not node.hasAttribute('pageSize'):
-            pageSize = (utils.as_pt('21cm'), utils.as_pt('29.7cm'))
-        else:
-            ps = map(lambda x:x.strip(),
-                     (node.getAttribute('pageSize').replace(')', '')
-                      .replace('(', '').split(',')))
-            pageSize = (utils.as_pt(ps[0]), utils.as_pt(ps[1]))
+        pageSize = _page_size(node)
         cm = reportlab.lib.units.cm
-        self.doc_tmpl = platypus.BaseDocTemplate(
-            out, pagesize=pageSize,
-            **utils.getAttrsAsDict(node,
-                                   ['leftMargin', 'rightMargin', 'topMargin',
-                                    'bottomMargin'],
-                                   {'allowSplitting': 'int',
-                                    'showBoundary': 'bool',
-                                    'title': 'str', 'author': 'str'}))
+        self.doc_tmpl = layout.RmlDocTemplate(
+            out, pagesize=pageSize, **_attrs(node))
+        self.doc_tmpl.options = doc.options
+        self.doc_tmpl.fixed = doc.fixed
         self.page_templates = []
         self.styles = doc.styles
         self.doc = doc
@@ -657,29 +1124,35 @@ class _rml_template(object):
         for pt in pts:
             frames = []
             for frame_el in pt.getElementsByTagName('frame'):
-                frame = platypus.Frame(
-                    **(utils.getAttrsAsDict(frame_el,
-                                            ['x1','y1', 'width', 'height',
-                                             'leftPadding', 'rightPadding',
-                                             'bottomPadding', 'topPadding'],
-                                            {'id': 'text', 'showBoundary': 'bool'})) )
+                frame = platypus.Frame(**_attrs(frame_el))
                 frames.append( frame )
             gr = pt.getElementsByTagName('pageGraphics')
             if len(gr):
-                drw = _rml_draw(gr[0], self.styles)
+                drw = _rml_draw(gr[0], self.styles, doc)
                 self.page_templates.append(
                     platypus.PageTemplate(frames=frames, onPage=drw.render,
-                                          **utils.getAttrsAsDict(pt, [], {'id': 'str'})))
+                                          **_attrs(pt)))
             else:
                 self.page_templates.append(
-                    platypus.PageTemplate(frames=frames,
-                                          **utils.getAttrsAsDict(pt, [], {'id': 'str'})))
+                    platypus.PageTemplate(frames=frames, **_attrs(pt)))
         self.doc_tmpl.addPageTemplates(self.page_templates)
 
-    def render(self, node_story):
+    def render(self, node_story, pages=None, canvasmaker=canvas.Canvas,
+               save=True):
         r = _rml_flowable(self.doc)
-        fis = r.render(node_story)
-        self.doc_tmpl.build(fis)
+        # page count and table of contents need a layout pass beforehand
+        deferred = bool(node_story.getElementsByTagName('pageCount'))
+        if (deferred or node_story.getElementsByTagName('tableOfContents')
+            or self.doc.dom.getElementsByTagName('pageCount')):
+            fis = r.render(node_story)
+            self.doc_tmpl.layout(fis, self.doc, deferred)
+        else:
+            # flowables are built as reached, and dropped once laid out
+            # (or past the last page, never built)
+            fis = layout.LazyStory(r.iter_render(node_story))
+        self.doc_tmpl._doSave = save
+        self.doc_tmpl.build(fis, canvasmaker=canvasmaker, pages=pages)
+        return self.doc_tmpl.canv
 
 
 def parseString(data, fout=None):
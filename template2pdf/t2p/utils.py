@@ -15,10 +15,84 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import hashlib
+import importlib
 import re
 from reportlab.lib import colors
 from reportlab.lib.units import inch, cm, mm
 
+# numpy module, imported on first use (None if not installed)
+_numpy = []
+
+
+def get_numpy():
+    """Import numpy on first call, returning None if not installed.
+    """
+    if not _numpy:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy.append(numpy)
+    return _numpy[0]
+
+
+class LazyModule(object):
+    """Module imported on first access to its attributes.
+
+    Keeps heavy modules from loading along with modules referring to
+    them, until used; name is an absolute module name.
+
+    >>> string = LazyModule('string')
+    >>> string.digits
+    '0123456789'
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+class ChunkReader(object):
+    """File-like object reading an iterable of chunks, as produced by
+    template engines; unicode chunks are read as UTF-8.
+
+    Lets documents be parsed while their chunks are being produced; digest
+    is an MD5 of the data read so far.
+
+    >>> reader = ChunkReader(['<a>', u'\\xe9', '</a>'])
+    >>> reader.read(4), reader.read()
+    ('<a>\\xc3', '\\xa9</a>')
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.rest = ''
+        self.digest = hashlib.md5()
+
+    def read(self, size=-1):
+        parts, length = [self.rest], len(self.rest)
+        while size<0 or length<size:
+            try:
+                chunk = self.chunks.next()
+            except StopIteration:
+                break
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            self.digest.update(chunk)
+            parts.append(chunk)
+            length += len(chunk)
+        data = ''.join(parts)
+        if size<0:
+            size = len(data)
+        self.rest = data[size:]
+        return data[:size]
+
 
 def as_bool(value):
     """Convert string into bool value.
@@ -42,7 +116,32 @@ bool_get = as_bool # for backward compatibility: will be removed soon.
 allcols = colors.getAllNamedColors()
 
 regex_t = re.compile('\(([0-9\.]*),([0-9\.]*),([0-9\.]*)\)')
-regex_h = re.compile('#([0-9a-zA-Z][0-9a-zA-Z])([0-9a-zA-Z][0-9a-zA-Z])([0-9a-zA-Z][0-9a-zA-Z])')
+regex_cmyk = re.compile('\(([0-9\.]*),([0-9\.]*),([0-9\.]*),([0-9\.]*)\)')
+regex_h = re.compile(r'#([0-9a-fA-F]{8}|[0-9a-fA-F]{6}|[0-9a-fA-F]{3})\b')
+
+# interns parsed colors, keyed by their string form
+COLOR_CACHE_SIZE = 256
+color_cache = {}
+
+
+def parse_color(col_str):
+    """Parse color string into reportlab color, without caching.
+    """
+    match = regex_cmyk.search(col_str, 0)
+    if match:
+        return colors.CMYKColor(*(float(v) for v in match.groups()))
+    match = regex_t.search(col_str, 0)
+    if match:
+        return colors.Color(*(float(v) for v in match.groups()))
+    match = regex_h.search(col_str, 0)
+    if match:
+        digits = match.group(1)
+        if len(digits)==3:
+            digits = ''.join(d*2 for d in digits)
+        values = [float(int(digits[i:i+2], 16))/255
+                  for i in range(0, len(digits), 2)]
+        return colors.Color(*values)
+    return colors.red
 
 
 def as_color(col_str):
@@ -51,7 +150,10 @@ def as_color(col_str):
     Supported formats are:
     1. Color name defined in reportlab.lib.colors.getAllNamedColors()
     2. tuple of RGB values in float, such as (1.0, 0.5, 0.25).
-    3. #-prefixed hexdigits, such as #33cc66.
+    3. tuple of CMYK values in float, such as (0, 0.5, 0.25, 0.1).
+    4. #-prefixed hexdigits, such as #33cc66, #3c6 or #33cc6680 (with alpha).
+
+    Parsed colors are interned, so the same string yields the same object.
 
     # Blue and BLUE is errournous, results in red (1,0,0)
     >>> as_color('blue'), as_color('Blue'), as_color('BLUE')
@@ -60,38 +162,50 @@ def as_color(col_str):
     Color(.25,.125,.75)
     >>> as_color('#3399ff')
     Color(.2,.6,1)
+    >>> as_color('#39f').rgb(), as_color('#39f') is as_color('#39f')
+    ((0.2, 0.6, 1.0), True)
+    >>> round(as_color('#3399ff80').alpha, 2)
+    0.5
+    >>> as_color('(0,0.5,0.25,0.1)').cmyk()
+    (0.0, 0.5, 0.25, 0.1)
     >>> as_color(''), as_color('nonexistent') # invalid format falls to red: (1,0,0).
     (Color(1,0,0), Color(1,0,0))
+    >>> as_color('#12345').rgb(), as_color('#1234').rgb() # and other lengths
+    ((1.0, 0.0, 0.0), (1.0, 0.0, 0.0))
     >>> as_color(None) # Non-string value should fail in TypeError
     Traceback (most recent call last):
     ...
     TypeError: expected string or buffer
     """
-    global allcols
-    if col_str in allcols.keys():
+    try:
         return allcols[col_str]
-    color_tuple = (1, 0, 0) # red
-    match = regex_t.search(col_str, 0)
-    if match:
-        return colors.Color(float(match.group(1)),
-                            float(match.group(2)),
-                            float(match.group(3)))
-    match = regex_h.search(col_str, 0)
-    if match:
-        return colors.Color(*(float(int(match.group(i+1),16))/255
-                              for i in range(3)))
-    return colors.red
+    except KeyError:
+        pass
+    try:
+        return color_cache[col_str]
+    except KeyError:
+        pass
+    color = parse_color(col_str)
+    if len(color_cache)>=COLOR_CACHE_SIZE:
+        color_cache.clear()
+    color_cache[col_str] = color
+    return color
 get = as_color # for backward compatibility
 
 
-unit_patterns = [
-    (re.compile('^(-?[0-9\.]+)\s*in$'), inch),
-    (re.compile('^(-?[0-9\.]+)\s*cm$'), cm),  
-    (re.compile('^(-?[0-9\.]+)\s*mm$'), mm),
-    (re.compile('^(-?[0-9\.]+)\s*$'), 1),]
+unit_regex = re.compile('^(-?[0-9\.]+)\s*(in|cm|mm)?$')
+units = {'in': inch, 'cm': cm, 'mm': mm, None: 1}
+
+# memoizes converted literals, such as '1cm' or '0.5mm'
+PT_CACHE_SIZE = 4096
+pt_cache = {}
+
+
 def as_pt(size):
     """Convert string into float value, parsing unit suffix.
 
+    Converted values are memoized, so repeated literals cost a dict lookup.
+
     >>> as_pt('1in'), as_pt('1.cm'), as_pt('.25mm'), as_pt('1')
     (72.0, 28.346456692913385, 0.70866141732283472, 1.0)
     >>> as_pt('.25'), as_pt('1.'), as_pt('1.25')
@@ -99,14 +213,58 @@ def as_pt(size):
     >>> as_pt('1ml') # invalid format yields False
     0
     """
-    for regexp, unit in unit_patterns:
-        match = regexp.search(size, 0)
-        if match:
-            return unit*float(match.group(1))
-    return 0
+    try:
+        return pt_cache[size]
+    except KeyError:
+        pass
+    match = unit_regex.match(size)
+    if match:
+        value = units[match.group(2)]*float(match.group(1))
+    else:
+        value = 0
+    if len(pt_cache)>=PT_CACHE_SIZE:
+        pt_cache.clear()
+    pt_cache[size] = value
+    return value
 unit_get = as_pt # for backward compatibility: will be removed soon.
 
 
+regex_unitless = re.compile('^[-0-9\.\s]*$')
+def as_pt_list(text):
+    """Convert whitespace separated sizes into list of float values.
+
+    The whole run is converted in one pass; runs without unit suffixes
+    are handed to numpy at once when it is available.
+
+    >>> as_pt_list(' 1in 2 .5in  1ml ')
+    [72.0, 2.0, 36.0, 0]
+    >>> as_pt_list('1 2.5 -3')
+    [1.0, 2.5, -3.0]
+
+    Malformed sizes count as 0, whichever way the run is converted.
+
+    >>> as_pt_list(u'1 - 2 3')
+    [1.0, 0, 2.0, 3.0]
+    """
+    if regex_unitless.match(text) and get_numpy() is not None:
+        sizes = get_numpy().fromstring(str(text), sep=' ').tolist()
+        # numpy stops at the first malformed size
+        if len(sizes)==len(text.split()):
+            return sizes
+    return [as_pt(size) for size in text.split()]
+
+
+def as_pt_tuples(text, size):
+    """Convert sizes like as_pt_list, grouped into tuples of given size.
+
+    Incomplete trailing group is dropped.
+
+    >>> as_pt_tuples('1 2 3 4 5 6 7', 3)
+    [(1.0, 2.0, 3.0), (4.0, 5.0, 6.0)]
+    """
+    return zip(*[iter(as_pt_list(text))]*size)
+
+
 def getAttrAsIntTuple(node, attr_name, default=None):
     """Get node attribute and convert into tuple of integers.
 
@@ -127,6 +285,45 @@ tuple_int_get = getAttrAsIntTuple # for backward compatibility.
 
 
 type_map = dict(str=unicode, bool=as_bool, int=int, text=unicode, pt=as_pt)
+OMIT = object() # marks attributes left out of the result when missing
+
+
+class AttrSchema(object):
+    """Attribute schema of an RML element, compiled into a converter.
+
+    Untyped attributes are converted by as_pt and default to 0, typed
+    attributes are converted by type_map and left out when missing.
+    Missing attributes never reach the converters.
+
+    >>> from xml.dom.minidom import parseString
+    >>> document = parseString('<rect x="1in" width="2" fill="1" />')
+    >>> node = document.childNodes[0]
+    >>> schema = AttrSchema(('x', 'y', 'width'), dict(fill='bool', id='str'))
+    >>> sorted(schema(node).items())
+    [('fill', True), ('width', 2.0), ('x', 72.0), ('y', 0)]
+    """
+
+    def __init__(self, attrs=(), typed_attrs={}):
+        self.fields = [(akey, type_map[typed_attrs[akey]], 0)
+                       if akey in typed_attrs else (akey, as_pt, 0)
+                       for akey in attrs]
+        self.fields.extend((akey, type_map[atype], OMIT)
+                           for akey, atype in typed_attrs.items()
+                           if akey not in attrs)
+
+    def __call__(self, node):
+        res = {}
+        get_attr = node.getAttributeNode
+        for akey, convert, default in self.fields:
+            attr = get_attr(akey)
+            if attr is not None:
+                res[akey] = convert(attr.value)
+            elif default is not OMIT:
+                res[akey] = default
+        return res
+
+
+schema_cache = {}
 def getAttrsAsDict(node, attrs, typed_attrs={}):
     """Returns dictionary of values for given attributes.
 
@@ -138,11 +335,12 @@ def getAttrsAsDict(node, attrs, typed_attrs={}):
     >>> getAttrsAsDict(node, ('spam', 'egg', 'bacon'), dict(spam='bool', egg='int'))
     {'bacon': 1.0, 'egg': 1, 'spam': True}
     """
-    res = dict((akey, as_pt(node.getAttribute(akey))) for akey in attrs)
-    res.update((akey, type_map[atype](node.getAttribute(akey)))
-               for akey, atype in typed_attrs.items()
-               if node.hasAttribute(akey))
-    return res
+    key = (tuple(attrs), tuple(sorted(typed_attrs.items())))
+    try:
+        schema = schema_cache[key]
+    except KeyError:
+        schema = schema_cache[key] = AttrSchema(attrs, typed_attrs)
+    return schema(node)
 attr_get = getAttrsAsDict # for backward compatibility: will be removed soon.
 
 
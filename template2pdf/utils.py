@@ -25,6 +25,7 @@ except:
 from t2p import trml2pdf
 from t2p import utils as t2putils
 from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
 
 # caches pre-loaded fonts
 FONT_CACHE = {}
@@ -60,20 +61,124 @@ def find_resource_abspath(path, resource_dirs):
     return find_resource_path(path, resource_dirs, absolute=True)
 
 
-def rml2pdf(rml, font_resolver=None, image_resolver=None):
+def rml2pdf(rml, font_resolver=None, image_resolver=None, sources=None,
+            pages=None, linearize=False, profile=None, deterministic=False,
+            timestamp=None):
     """Generates CJK-aware PDF using (a forked) trml2pdf.
+
+    rml is a string, or an iterable of chunks (e.g. from a template engine)
+    parsed as they are produced, without joining them first.
+
+    sources maps names to Python objects which RML elements may refer
+    to, such as chart series. Rows of a <rowTemplate> may come from a
+    callable returning a fresh iterator for each layout pass; one-shot
+    iterators are recorded in full when the document is laid out more than
+    once (see t2p.tables.BoundTable).
+
+    pages limits output to a number of leading pages, or to a (first,
+    last) range of pages counted from 1, e.g. for previews. Layout stops
+    after the last page, unless the document shows page count or table of
+    contents, which need the whole document laid out.
+
+    linearize writes linearized ("fast web view") PDF, of which viewers
+    show the first page before the rest is downloaded. It needs qpdf, an
+    optional dependency (see INSTALL.txt and t2p.output.linearize):
+    without it, PDF is returned as it is, with a RuntimeWarning.
+
+    profile names output options: 'fast' (quickest, larger), 'default' or
+    'small' (slowest, packed with qpdf if installed, see INSTALL.txt); see
+    t2p.output.
+
+    deterministic makes the same rml give the same bytes, for caching and
+    deduplication: dates are fixed at timestamp (seconds since the epoch,
+    2000-01-01 or SOURCE_DATE_EPOCH by default), and the document ID is
+    derived from a digest of rml, or from deterministic if not True (pass
+    a version of fonts, images and sources, which the digest leaves out).
+    """
+    doc = trml2pdf._rml_doc(rml, font_resolver, image_resolver, sources)
+    buf = StringIO()
+    doc.render(buf, pages, linearize=linearize, profile=profile,
+               deterministic=deterministic, timestamp=timestamp)
+    return buf.getvalue()
+
+
+def rml2pdf_records(rmls, font_resolver=None, image_resolver=None,
+                    sources=None):
+    """Generates one PDF from a sequence of RML documents, e.g. letters of
+    a mail merge.
+
+    Documents are rendered one after another into the same PDF, so fonts,
+    images and <static> page graphics are embedded once. Page numbers
+    restart for each document.
     """
-    doc = trml2pdf._rml_doc(rml, font_resolver, image_resolver)
     buf = StringIO()
-    doc.render(buf)
+    canv = canvas.Canvas(buf)
+    for rml in rmls:
+        doc = trml2pdf._rml_doc(rml, font_resolver, image_resolver, sources)
+        doc.render_on(canv)
+    canv.save()
     return buf.getvalue()
 
+
+def rml2pdf_split(rml, filename_pattern, max_pages=None, max_bytes=None,
+                  font_resolver=None, image_resolver=None, sources=None,
+                  profile=None, deterministic=False, timestamp=None):
+    """Generates PDF split into files of at most max_pages pages, or of
+    about max_bytes of page content each.
+
+    filename_pattern is formatted with the part number (from 1), e.g.
+    'export-%03d.pdf'. Parts are written as soon as they are complete;
+    returns the list of filenames written. profile, deterministic and
+    timestamp are as of rml2pdf; each part has its own document ID.
+    """
+    doc = trml2pdf._rml_doc(rml, font_resolver, image_resolver, sources)
+    return doc.render(filename_pattern, max_pages=max_pages,
+                      max_bytes=max_bytes, profile=profile,
+                      deterministic=deterministic, timestamp=timestamp)
+
+def warm_up(rml, font_resolver=None, image_resolver=None, sources=None,
+            render=False):
+    """Loads what rendering rml needs beforehand: fonts of its <docinit>,
+    its images and the shared stylesheet. With render, rml is rendered
+    once too, and the output thrown away.
+    """
+    doc = trml2pdf._rml_doc(rml, font_resolver, image_resolver, sources)
+    doc.docinit(doc.dom.getElementsByTagName('docinit'))
+    for node in doc.dom.getElementsByTagName('image'):
+        doc.image_resolver(node)
+    trml2pdf.get_sample_styles()
+    if render:
+        rml2pdf(rml, font_resolver, image_resolver, sources)
+
+
 class ImageResolver(object):
     """Default image resolver.
+
+    Images are read once per path and modification time if image_cache (a
+    dict) is given, which holds at most image_cache_size images; it is
+    emptied once full.
+
+    processor (a template2pdf.images.ImageProcessor), if given, downsamples
+    images larger than needed for the size they are placed at.
     """
 
-    def __init__(self, image_dirs=None):
+    def __init__(self, image_dirs=None, image_cache=None, processor=None,
+                 image_cache_size=64):
         self.image_dirs = image_dirs
+        self.image_cache = image_cache
+        self.processor = processor
+        self.image_cache_size = image_cache_size
+
+    def _cached(self, key, load, *args):
+        if self.image_cache is None:
+            return load(*args)
+        img = self.image_cache.get(key)
+        if img is None:
+            img = load(*args)
+            if len(self.image_cache)>=self.image_cache_size:
+                self.image_cache.clear()
+            self.image_cache[key] = img
+        return img
 
     def resolve_image(self, node):
         # Get filename from image node attribute file
@@ -86,9 +191,9 @@ class ImageResolver(object):
             # On fail, return None
             return None, None
 
-        # Open the file on the image reader
-        fd = file(path, "r")
-        img = ImageReader(fd)
+        # Read the file on the image reader; changed files are read again
+        key = (path, os.path.getmtime(path))
+        img = self._cached(key, read_image, path)
 
         (sx, sy) = img.getSize()
         args = {}
@@ -104,8 +209,29 @@ class ImageResolver(object):
                 args['width'] = sx * args['height'] / sy
             else:
                 args['height'] = sy * args['width'] / sx
+        if self.processor is not None and 'width' in args:
+            img = self._cached(key+(args['width'], args['height']),
+                               self.process_image, path, img,
+                               args['width'], args['height'])
         return img, args
 
+    def process_image(self, path, img, width, height):
+        """img of path, as processed for width x height points.
+        """
+        return self.processor.process(path, img.getSize(), width,
+                                      height) or img
+
+
+def read_image(path):
+    """ImageReader of image file path, read into memory (the file is not
+    kept open).
+    """
+    fp = open(path, 'rb')
+    try:
+        return ImageReader(StringIO(fp.read()))
+    finally:
+        fp.close()
+
 class FontResolver(object):
     """Default font resolver.
     """
@@ -12,3 +12,89 @@ suite = unittest.TestSuite()
 
 import template2pdf.utils
 suite.addTests(doctest.DocTestSuite(template2pdf.utils))
+import template2pdf.t2p.charts
+suite.addTests(doctest.DocTestSuite(template2pdf.t2p.charts))
+import template2pdf.t2p.tables
+suite.addTests(doctest.DocTestSuite(template2pdf.t2p.tables))
+import template2pdf.t2p.layout
+suite.addTests(doctest.DocTestSuite(template2pdf.t2p.layout))
+import template2pdf.t2p.overlay
+suite.addTests(doctest.DocTestSuite(template2pdf.t2p.overlay))
+import template2pdf.t2p.barcodes
+suite.addTests(doctest.DocTestSuite(template2pdf.t2p.barcodes))
+import template2pdf.t2p.output
+suite.addTests(doctest.DocTestSuite(template2pdf.t2p.output))
+import template2pdf.coalesce
+suite.addTests(doctest.DocTestSuite(template2pdf.coalesce))
+import template2pdf.conditional
+suite.addTests(doctest.DocTestSuite(template2pdf.conditional))
+import template2pdf.images
+suite.addTests(doctest.DocTestSuite(template2pdf.images))
+
+import import_time
+
+class ImportTimeTest(unittest.TestCase):
+    """Heavy ReportLab parts load on first use, not on import.
+    """
+
+    def test_heavy_modules(self):
+        for name in import_time.MODULES:
+            self.assertEqual(import_time.heavy_modules(name), [], name)
+
+suite.addTests(unittest.makeSuite(ImportTimeTest))
+
+from template2pdf.utils import rml2pdf
+
+class DeterministicTest(unittest.TestCase):
+    """Deterministic renders of the same RML give the same bytes.
+    """
+    rml = ('<document filename="a.pdf"><template><pageTemplate id="main">'
+           '<frame id="body" x1="72" y1="72" width="451" height="698"/>'
+           '</pageTemplate></template><stylesheet/><story><para>Text</para>'
+           '</story></document>')
+
+    def test_same_bytes(self):
+        pdf = rml2pdf(self.rml, deterministic=True, timestamp=0)
+        self.assertEqual(rml2pdf(self.rml, deterministic=True, timestamp=0),
+                         pdf)
+        self.assertTrue("/CreationDate (D:19700101000000+00'00')" in pdf)
+
+    def test_seed(self):
+        self.assertNotEqual(rml2pdf(self.rml, deterministic='1'),
+                            rml2pdf(self.rml, deterministic='2'))
+
+suite.addTests(unittest.makeSuite(DeterministicTest))
+
+import os
+import tempfile
+from template2pdf.images import Image, ImageCache, ImageProcessor
+
+class ImageProcessorTest(unittest.TestCase):
+    """Large images are downsampled once, then taken from the cache.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = join(self.directory, 'photo.jpg')
+        Image.new('RGB', (2000, 1500), (200, 100, 50)).save(self.path)
+
+    def test_downsample(self):
+        cache = ImageCache(join(self.directory, 'cache'))
+        processor = ImageProcessor(dpi=144, cache=cache)
+        img = processor.process(self.path, (2000, 1500), 100, 75)
+        self.assertEqual(img.getSize(), (200, 150))
+        processor.resample = None
+        img = processor.process(self.path, (2000, 1500), 100, 75)
+        self.assertEqual(img.getSize(), (200, 150))
+        self.assertEqual(len(os.listdir(cache.directory)), 1)
+        self.assertEqual(processor.process(self.path, (2000, 1500), 1000,
+                                           750), None)
+
+if Image is not None:
+    suite.addTests(unittest.makeSuite(ImageProcessorTest))
+
+import render
+suite.addTests(render.suite)
+
+import frameworks
+suite.addTests(frameworks.suite)
@@ -0,0 +1,76 @@
+# coding: utf-8
+"""Time to first page of plain and linearized PDF, over a slow link.
+
+Usage: python tests/first_page.py [pages] [kbit/s]
+
+Renders a report of pages pages (150 by default) both ways, and prints
+the bytes a viewer reading the file as it downloads needs before showing
+page 1, with the time they take at the given rate (1000 kbit/s by
+default). Plain PDF ends with its cross-reference table, so it is usable
+once complete; linearized PDF tells the end of its first page section
+(/E of its linearization dictionary). Linearizing needs qpdf; the script
+exits if it is not installed.
+"""
+from distutils.spawn import find_executable
+from os.path import abspath, dirname
+import re
+import sys
+import time
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from template2pdf.utils import rml2pdf
+from template2pdf.t2p import output
+
+RML = '''<?xml version="1.0" encoding="utf-8"?>
+<document filename="report.pdf">
+<template pageSize="(595, 842)">
+  <pageTemplate id="main">
+    <pageGraphics>
+      <drawString x="40" y="20">Report <pageNumber/></drawString>
+    </pageGraphics>
+    <frame id="body" x1="40" y1="40" width="515" height="762"/>
+  </pageTemplate>
+</template>
+<stylesheet/>
+<story>
+%s
+</story>
+</document>
+'''
+PARAGRAPH = ('<para>Line %d of the report, with enough text to wrap over '
+             'the width of the frame a couple of times, as reports do.</para>')
+# paragraphs filling about a page
+PER_PAGE = 20
+
+regex_first_page_end = re.compile(r'/E (\d+)')
+
+
+def first_page_bytes(pdf):
+    """Bytes of pdf needed before its first page can be shown.
+    """
+    if output.is_linearized(pdf):
+        return int(regex_first_page_end.search(pdf[:1024]).group(1))
+    return len(pdf)
+
+
+def main(pages=150, rate=1000):
+    command = output.LINEARIZE_COMMAND[0]
+    if not find_executable(command):
+        sys.exit('%s is not installed; it is needed to linearize PDF '
+                 '(see INSTALL.txt)' %(command))
+    rml = RML %('\n'.join([PARAGRAPH %(i) for i in range(pages*PER_PAGE)]))
+    for linearize in (False, True):
+        start = time.time()
+        pdf = rml2pdf(rml, linearize=linearize)
+        elapsed = time.time()-start
+        if linearize and not output.is_linearized(pdf):
+            sys.exit('%s did not linearize PDF' %(command))
+        needed = first_page_bytes(pdf)
+        print ('%-10s %8d bytes, rendered in %.2fs, first page after %8d '
+               'bytes (%.2fs at %d kbit/s)'
+               %(linearize and 'linearized' or 'plain', len(pdf), elapsed,
+                 needed, needed*8/1000./rate, rate))
+
+
+if __name__=='__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,134 @@
+# coding: utf-8
+"""Rendering from templates of Django and Flask, registered when they are
+installed.
+"""
+import os
+import tempfile
+import unittest
+
+try:
+    import django
+except ImportError:
+    django = None
+try:
+    from template2pdf import fsk
+except ImportError:
+    fsk = None
+
+BASE = ('<document filename="%s.pdf"><template><pageTemplate id="main">'
+        '<frame id="body" x1="72" y1="72" width="451" height="698"/>'
+        '</pageTemplate></template><stylesheet/><story>%s</story>'
+        '</document>')
+TEMPLATES = {
+    'django/base.rml': BASE %('{{ name }}', '{% block body %}{% endblock %}'
+                                           '<para>{{ name }}</para>'),
+    'django/part.rml': '<para>Included {{ name }}</para>',
+    'django/include.rml': BASE %('include', '{% include "django/part.rml" %}'
+                                            '<para>{{ name }}</para>'),
+    'django/extends.rml': ('{% extends "django/base.rml" %}{% block body %}'
+                           '<para>Extended</para>{% endblock %}'),
+    }
+
+
+def template_dir():
+    """Directory holding TEMPLATES, in a new temporary directory.
+    """
+    directory = tempfile.mkdtemp()
+    for name, text in TEMPLATES.items():
+        path = os.path.join(directory, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').write(text)
+    return directory
+
+
+class DjangoTest(unittest.TestCase):
+    """Django templates rendered chunk by chunk, including and extending
+    others.
+    """
+
+    def setUp(self):
+        from django.conf import settings
+        if not settings.configured:
+            settings.configure(TEMPLATES=[{
+                'BACKEND': 'django.template.backends.django.DjangoTemplates',
+                'DIRS': [template_dir()]}])
+            getattr(django, 'setup', lambda: None)()
+
+    def test_chunks(self):
+        from template2pdf.dj import render_to_chunks, render_to_pdf
+        params = dict(name='Ann')
+        rml = ''.join(render_to_chunks('django/include.rml', params))
+        self.assertTrue('<para>Included Ann</para><para>Ann</para>' in rml)
+        rml = ''.join(render_to_chunks('django/extends.rml', params))
+        self.assertTrue('<para>Extended</para><para>Ann</para>' in rml)
+        pdf = render_to_pdf('django/include.rml', params, stream=True)
+        self.assertEqual(pdf[:8], '%PDF-1.4')
+
+    def test_conditional(self):
+        from django.test import RequestFactory
+        from template2pdf.dj import direct_to_pdf
+        params = dict(name='Ann')
+        resp = direct_to_pdf(RequestFactory().get('/'), 'django/include.rml',
+                             dict(params))
+        self.assertEqual((resp.status_code, resp['Content-Type']),
+                         (200, 'application/pdf'))
+        etag, length = resp['ETag'], len(resp.content)
+        request = RequestFactory().get('/', HTTP_IF_NONE_MATCH=etag)
+        resp = direct_to_pdf(request, 'django/include.rml', dict(params))
+        self.assertEqual((resp.status_code, resp.content), (304, ''))
+        request = RequestFactory().get('/', HTTP_RANGE='bytes=0-99')
+        resp = direct_to_pdf(request, 'django/include.rml', dict(params))
+        self.assertEqual((resp.status_code, len(resp.content)), (206, 100))
+        self.assertEqual(resp['Content-Range'], 'bytes 0-99/%d' %(length))
+
+
+class FlaskTest(unittest.TestCase):
+    """The Jinja environment follows settings made after import.
+    """
+
+    def setUp(self):
+        self.settings = (fsk.environment, fsk.TEMPLATE_CACHE_SIZE,
+                         fsk.BYTECODE_CACHE_DIR)
+
+    def tearDown(self):
+        (fsk.environment, fsk.TEMPLATE_CACHE_SIZE,
+         fsk.BYTECODE_CACHE_DIR) = self.settings
+
+    def test_environment(self):
+        directory = tempfile.mkdtemp()
+        fsk.environment = None
+        fsk.TEMPLATE_CACHE_SIZE = 5
+        fsk.BYTECODE_CACHE_DIR = directory
+        rml = ''.join(fsk.generate('base.rml', dict(pdf_name='a.pdf')))
+        self.assertTrue('<document filename="a.pdf">' in rml)
+        self.assertEqual(fsk.get_environment().cache.capacity, 5)
+        self.assertEqual(len(os.listdir(directory)), 1)
+        pdf = fsk.render_to_pdf('base.rml', dict(pdf_name='a.pdf'))
+        self.assertEqual(pdf[:8], '%PDF-1.4')
+
+    def test_conditional(self):
+        from flask import Flask
+        app = Flask(__name__)
+        def get(**headers):
+            with app.test_request_context('/', headers=headers):
+                return fsk.direct_to_pdf('base.rml', dict(pdf_name='a.pdf'))
+        resp = get()
+        self.assertEqual((resp.status_code, resp.mimetype),
+                         (200, 'application/pdf'))
+        etag, length = resp.headers['ETag'], len(resp.data)
+        resp = get(**{'If-None-Match': etag})
+        self.assertEqual((resp.status_code, resp.data), (304, ''))
+        resp = get(Range='bytes=0-99')
+        self.assertEqual((resp.status_code, len(resp.data)), (206, 100))
+        self.assertEqual(resp.headers['Content-Range'],
+                         'bytes 0-99/%d' %(length))
+        resp = get(Range='bytes=0-99', **{'If-Range': '"stale"'})
+        self.assertEqual((resp.status_code, len(resp.data)), (200, length))
+
+
+suite = unittest.TestSuite()
+if django is not None:
+    suite.addTests(unittest.makeSuite(DjangoTest))
+if fsk is not None:
+    suite.addTests(unittest.makeSuite(FlaskTest))
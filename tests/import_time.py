@@ -0,0 +1,85 @@
+# coding: utf-8
+"""Import time of template2pdf modules, each imported in a fresh process.
+
+Usage: python tests/import_time.py [runs]
+
+Prints the median import time of each module, with that of ReportLab
+modules for comparison; template2pdf.dj is imported with Django settings
+configured, if Django is installed. ReportLab parts which modules should not load
+until documents use them are listed in HEAVY_MODULES (tested in tests).
+"""
+from os.path import abspath, dirname
+import subprocess
+import sys
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+MODULES = ['template2pdf.t2p.trml2pdf', 'template2pdf.utils']
+try:
+    import django
+except ImportError:
+    pass
+else:
+    MODULES.append('template2pdf.dj')
+REFERENCES = ['reportlab.pdfgen.canvas', 'reportlab.platypus']
+
+# loaded on first use of flowables, drawings, charts or barcodes
+HEAVY_MODULES = ['reportlab.platypus', 'reportlab.graphics', 'numpy']
+
+# run before timing the import of a module, e.g. as a web application
+# would have done already
+SETUP = {
+    'template2pdf.dj': (
+        'from django.conf import settings\n'
+        'settings.configure()\n'
+        'import django\n'
+        'getattr(django, "setup", lambda: None)()\n'),
+    }
+
+SCRIPT = '''
+import sys, time
+sys.path.insert(0, %r)
+%s
+start = time.time()
+import %s
+elapsed = time.time()-start
+print elapsed
+print ' '.join([name for name, module in sys.modules.items() if module])
+'''
+
+
+def import_module(name):
+    """Import module name in a fresh interpreter.
+
+    Returns (seconds taken, names of modules loaded).
+    """
+    script = SCRIPT %(ROOT, SETUP.get(name, ''), name)
+    output = subprocess.Popen([sys.executable, '-c', script],
+                              stdout=subprocess.PIPE).communicate()[0]
+    elapsed, modules = output.splitlines()
+    return float(elapsed), modules.split()
+
+
+def heavy_modules(name):
+    """Names of HEAVY_MODULES loaded by importing module name.
+    """
+    loaded = import_module(name)[1]
+    return sorted([heavy for heavy in HEAVY_MODULES if heavy in loaded])
+
+
+def median_time(name, runs=5):
+    times = sorted([import_module(name)[0] for i in range(runs)])
+    return times[len(times)//2]
+
+
+def main(runs=5):
+    for name in MODULES+REFERENCES:
+        print '%-32s %.3fs' %(name, median_time(name, runs))
+    for name in MODULES:
+        heavy = heavy_modules(name)
+        if heavy:
+            print '%s loads %s' %(name, ', '.join(heavy))
+
+
+if __name__=='__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,78 @@
+# coding: utf-8
+"""Size and render time of each output profile.
+
+Usage: python tests/profiles.py [pages] [runs]
+
+Renders a report of pages pages (50 by default) of paragraphs, a table
+and an image with each profile of t2p.output, and prints the size of the
+PDF and the median render time of runs runs (3 by default). The small
+profile packs objects with qpdf, if installed; its line tells when it was
+not packed.
+"""
+from os.path import abspath, dirname, join
+import sys
+import time
+import warnings
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+from template2pdf.utils import rml2pdf
+from template2pdf.t2p import output
+
+IMAGE = join(ROOT, 'demos', 'django', 'myproject', 'resources', 'images',
+             'logo.png')
+
+RML = '''<?xml version="1.0" encoding="utf-8"?>
+<document filename="report.pdf">
+<template pageSize="(595, 842)">
+  <pageTemplate id="main">
+    <pageGraphics>
+      <image file="%(image)s" x="40" y="800" width="60"/>
+      <drawString x="40" y="20">Report <pageNumber/></drawString>
+    </pageGraphics>
+    <frame id="body" x1="40" y1="40" width="515" height="750"/>
+  </pageTemplate>
+</template>
+<stylesheet/>
+<story>
+%(body)s
+</story>
+</document>
+'''
+SECTION = '''<para>Section %(i)d. Figures of the period are listed below, with
+notes on each line item, as statements and reports usually have.</para>
+<blockTable colWidths="200,100,100" splitByRow="1">
+%(rows)s
+</blockTable>
+'''
+ROW = '<tr><td>Item %d</td><td>%d</td><td>%.2f</td></tr>'
+
+
+def report(pages):
+    body = [SECTION %dict(i=i, rows='\n'.join([ROW %(j, j*7, j*1.25)
+                                               for j in range(30)]))
+            for i in range(pages)]
+    return RML %dict(image=IMAGE, body='\n'.join(body))
+
+
+def main(pages=50, runs=3):
+    rml = report(pages)
+    print '%-8s %10s %8s' %('profile', 'bytes', 'seconds')
+    for name in ('fast', 'default', 'small'):
+        times = []
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', RuntimeWarning)
+            for i in range(runs):
+                start = time.time()
+                pdf = rml2pdf(rml, profile=name)
+                times.append(time.time()-start)
+        note = ''
+        if caught:
+            # rewrite command missing
+            note = '  (not rewritten: %s)' %(caught[0].message)
+        print '%-8s %10d %8.3f%s' %(name, len(pdf), sorted(times)[runs//2],
+                                    note)
+
+
+if __name__=='__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
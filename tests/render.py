@@ -0,0 +1,516 @@
+# coding: utf-8
+"""Documents rendered end to end, checked on the text of their pages.
+
+PDF is rendered with the fast profile, so page content is left
+uncompressed and strings drawn can be looked up in it; streams of other
+output are decoded first.
+"""
+import os
+import re
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+from xml.dom.minidom import parseString
+
+from reportlab.lib.rl_accel import asciiBase85Decode
+
+from template2pdf.conditional import respond, rml_etag
+from template2pdf.images import Image
+from template2pdf.t2p import trml2pdf
+from template2pdf.t2p.utils import get_numpy
+from template2pdf.utils import (ImageResolver, rml2pdf, rml2pdf_records,
+                                rml2pdf_split, warm_up)
+
+DOCUMENT = '''<?xml version="1.0" encoding="utf-8"?>
+<document filename="test.pdf">
+<template pageSize="(595, 842)">
+  <pageTemplate id="main">
+    <pageGraphics>%(graphics)s</pageGraphics>
+    <frame id="body" x1="40" y1="40" width="515" height="762"/>
+  </pageTemplate>
+</template>
+<stylesheet>%(styles)s</stylesheet>
+<story>
+%(story)s
+</story>
+</document>
+'''
+PAGE_FOOTER = ('<drawString x="40" y="20">Page <pageNumber/> of '
+               '<pageCount/></drawString>')
+
+regex_page = re.compile(r'/Type /Page\b(?!s)')
+regex_string = re.compile(r'\(((?:[^()\\]|\\.)*)\) Tj')
+regex_stream = re.compile(r'<<(.*?)>>\s*stream\r?\n(.*?)endstream', re.S)
+regex_placed = re.compile(r'1 0 0 1 ([\d.]+) [\d.]+ Tm '
+                          r'\(((?:[^()\\]|\\.)*)\) Tj')
+
+
+def document(story, graphics='', styles=''):
+    return DOCUMENT %dict(story=story, graphics=graphics, styles=styles)
+
+
+def render(rml, **kw):
+    return rml2pdf(rml, profile='fast', **kw)
+
+
+def page_count(pdf):
+    return len(regex_page.findall(pdf))
+
+
+def content(pdf):
+    """Streams of pdf, decoded.
+    """
+    streams = []
+    for dictionary, data in regex_stream.findall(pdf):
+        if 'ASCII85Decode' in dictionary:
+            data = asciiBase85Decode(data)
+        if 'FlateDecode' in dictionary:
+            data = zlib.decompress(data)
+        streams.append(data)
+    return '\n'.join(streams)
+
+
+def strings(pdf):
+    """Strings drawn in pdf, in order.
+    """
+    return regex_string.findall(content(pdf))
+
+
+def offsets(pdf):
+    """Set of x offsets each string is drawn at, by string.
+    """
+    placed = {}
+    for x, text in regex_placed.findall(content(pdf)):
+        placed.setdefault(text, set()).add(float(x))
+    return placed
+
+
+def rows(count):
+    return [('item %d' %(i), i) for i in range(count)]
+
+
+BOUND_TABLE = '''<blockTable colWidths="200,100" repeatRows="1">
+<tr><td>Name</td><td>Qty</td></tr>
+<rowTemplate source="rows" chunkRows="20">
+  <td field="0"/><td field="1"/>
+</rowTemplate>
+</blockTable>'''
+
+
+class DrawingTest(unittest.TestCase):
+    """Drawing elements and their attributes.
+    """
+
+    def check(self, drawing, *ops):
+        pdf = render('<document filename="c.pdf"><pageDrawing>%s'
+                     '</pageDrawing></document>' %(drawing))
+        for op in ops:
+            self.assertTrue(op in content(pdf), op)
+
+    def test_attributes(self):
+        self.check('<rect x="1cm" y="2cm" width="3cm" height="1cm" fill="1"/>'
+                   '<rect x="10" y="10" width="20" height="30"/>',
+                   '28.34646 56.69291 85.03937 28.34646 re B*',
+                   '10 10 20 30 re S')
+
+    def test_colors(self):
+        self.check('<fill color="#f00"/><stroke color="blue"/>'
+                   '<rect x="0" y="0" width="1" height="1" fill="1"/>'
+                   '<fill color="(0,0.5,0.25,0.1)"/>'
+                   '<rect x="0" y="0" width="1" height="1" fill="1"/>',
+                   '1 0 0 rg', '0 0 1 RG', '0 .5 .25 .1 k')
+
+    def test_coordinates(self):
+        self.check('<lines>10 10 100 100 100 10 200 200</lines>'
+                   '<curves>0 0 10 10 20 10 30 0</curves>'
+                   '<path x="50" y="50" close="1">60 60 70 50</path>',
+                   '10 10 m 100 100 l\n100 10 m 200 200 l',
+                   '0 0 m 10 10 20 10 30 0 c', '50 50 m 60 60 l 70 50 l h')
+
+
+class BoundTableTest(unittest.TestCase):
+    """Tables of <rowTemplate> rows spanning pages.
+    """
+
+    def check(self, source):
+        pdf = render(document(BOUND_TABLE, PAGE_FOOTER),
+                     sources=dict(rows=source))
+        drawn = strings(pdf)
+        self.assertEqual(page_count(pdf), 5)
+        self.assertTrue('Page 5 of 5' in drawn)
+        self.assertEqual(drawn.count('Name'), 5)
+        self.assertTrue('item 0' in drawn and 'item 199' in drawn)
+
+    def test_page_count(self):
+        self.check(rows(200))
+
+    def test_page_count_generator(self):
+        self.check(iter(rows(200)))
+
+    def test_page_count_callable(self):
+        calls = []
+        def source():
+            calls.append(1)
+            return iter(rows(200))
+        self.check(source)
+        self.assertTrue(len(calls)>1)
+
+
+class PageCountTest(unittest.TestCase):
+    """<pageCount/> and <tableOfContents/>, laid out in a measuring pass.
+    """
+
+    def test_flowables(self):
+        story = '\n'.join(['<para>Line %d</para>' %(i) for i in range(80)])
+        for tag in ('para', 'xpre', 'pre'):
+            pdf = render(document(
+                '<%s>Pages: <pageCount/></%s>\n%s' %(tag, tag, story)))
+            self.assertEqual(page_count(pdf), 2)
+            self.assertTrue('Pages: 2' in strings(pdf), tag)
+
+    def test_table_of_contents(self):
+        pdf = render(document('<tableOfContents/>' + ''.join([
+            '<h1>Chapter %d</h1><para>Text</para><pageBreak/>' %(i)
+            for i in range(3)])))
+        self.assertEqual(page_count(pdf), 3)
+        self.assertEqual(strings(pdf)[:6], ['1', 'Chapter 0', '2',
+                                            'Chapter 1', '3', 'Chapter 2'])
+
+
+class PreviewTest(unittest.TestCase):
+    """Pages of a range are written, numbered as in the whole document.
+    """
+
+    def test_range(self):
+        story = '\n'.join(['<para>Line %d</para>' %(i) for i in range(300)])
+        pdf = render(document(story, PAGE_FOOTER), pages=(2, 3))
+        self.assertEqual(page_count(pdf), 2)
+        self.assertEqual([text for text in strings(pdf)
+                          if text.startswith('Page')],
+                         ['Page 2 of 5', 'Page 3 of 5'])
+        self.assertEqual(page_count(render(document(story), pages=1)), 1)
+
+
+class StaticTest(unittest.TestCase):
+    """<static> page graphics are drawn once, shown on every page.
+    """
+
+    def test_form(self):
+        story = '\n'.join(['<para>Line %d</para>' %(i) for i in range(150)])
+        pdf = render(document(story, '<static><rect x="10" y="10" width="100" '
+                              'height="100"/><drawString x="300" y="800">'
+                              'Letterhead</drawString></static>'))
+        self.assertEqual(page_count(pdf), 3)
+        self.assertEqual(pdf.count('/Subtype /Form'), 1)
+        self.assertEqual(len(re.findall(r'/FormXob\.\w+ Do', content(pdf))), 3)
+        self.assertEqual(strings(pdf).count('Letterhead'), 1)
+
+
+class RecordsTest(unittest.TestCase):
+    """Documents rendered into one PDF, page numbers restarting.
+    """
+
+    def test_records(self):
+        footer = '<drawString x="40" y="20">Page <pageNumber/></drawString>'
+        pdf = rml2pdf_records([document('<para>Record %d</para>' %(i), footer)
+                               for i in range(3)])
+        self.assertEqual(page_count(pdf), 3)
+        self.assertEqual(strings(pdf), ['Page 1', 'Record 0', 'Page 1',
+                                        'Record 1', 'Page 1', 'Record 2'])
+
+
+class LabelTest(unittest.TestCase):
+    """Records of a source drawn into the cells of label sheets.
+    """
+
+    def test_sheets(self):
+        rml = ('<document filename="l.pdf"><labelSheet source="people" '
+               'x="1cm" y="1cm" width="6cm" height="3cm" colGap="0.5cm" '
+               'rowGap="0.5cm" rows="4" cols="3"><drawString x="5" y="5">'
+               '%(name)s</drawString></labelSheet></document>')
+        people = [dict(name='Person %d' %(i)) for i in range(25)]
+        pdf = render(rml, sources=dict(people=people))
+        self.assertEqual(page_count(pdf), 3)
+        self.assertEqual(strings(pdf), [person['name'] for person in people])
+
+
+class BarcodeTest(unittest.TestCase):
+    """Barcodes in the story and on pages, unknown codes as Code 128.
+    """
+
+    def test_bars(self):
+        bars = render(document('<barCode code="code128">HELLO123</barCode>',
+                               '<barCode x="40" y="800">HELLO123</barCode>'))
+        self.assertEqual(content(bars).count(' re f*'), 2*34)
+        other = render(document('<barCode code="unknown">HELLO123</barCode>'))
+        self.assertEqual(content(other).count(' re f*'), 34)
+
+
+class ChartTest(unittest.TestCase):
+    """Charts of series from data and sources, lists or numpy arrays.
+    """
+    charts = ('<lineChart width="10cm" height="5cm" source="series"/>',
+              '<scatterChart width="10cm" height="5cm" source="series"/>',
+              '<barChart width="10cm" height="5cm" source="series"/>')
+
+    def check(self, series, charts=charts):
+        pdf = render(document(''.join(charts)), sources=dict(series=series))
+        self.assertEqual(page_count(pdf), 1)
+
+    def test_lists(self):
+        self.check([[float(i%7-3) for i in range(5000)]])
+        # (x, y) pairs for line and scatter charts
+        self.check([[(i, float(i%7)) for i in range(5000)]], self.charts[:2])
+
+    def test_numpy(self):
+        numpy = get_numpy()
+        if numpy is None:
+            return
+        values = numpy.sin(numpy.arange(5000)/50.)
+        self.check([values, values*2])
+        self.check(numpy.vstack((values, -values)))
+        pairs = numpy.column_stack((numpy.arange(5000), values))
+        self.check([pairs], self.charts[:2])
+
+    def test_empty(self):
+        self.assertRaises(ValueError, render, document(
+            '<lineChart width="10cm" height="5cm" data=""/>'))
+
+
+class ImageResolverTest(unittest.TestCase):
+    """Images are cached by path and modification time, up to a bound.
+    """
+
+    def test_cache(self):
+        if Image is None:
+            return
+        directory = tempfile.mkdtemp()
+        node = parseString('<image file="a.png" width="10"/>').documentElement
+        cache = {}
+        resolver = ImageResolver([directory], cache, image_cache_size=2)
+        path = os.path.join(directory, 'a.png')
+        Image.new('RGB', (20, 10)).save(path)
+        img, args = resolver.resolve_image(node)
+        self.assertEqual((img.getSize(), args['height']), ((20, 10), 5))
+        self.assertTrue(resolver.resolve_image(node)[0] is img)
+        Image.new('RGB', (10, 10)).save(path)
+        os.utime(path, (0, 0))
+        img, args = resolver.resolve_image(node)
+        self.assertEqual((img.getSize(), args['height']), ((10, 10), 10))
+        os.utime(path, (1, 1))
+        resolver.resolve_image(node)
+        self.assertEqual(len(cache), 1)
+
+
+class WarmUpTest(unittest.TestCase):
+    """Images of a document are resolved before it is rendered.
+    """
+
+    def test_images(self):
+        if Image is None:
+            return
+        directory = tempfile.mkdtemp()
+        Image.new('RGB', (20, 10)).save(os.path.join(directory, 'a.png'))
+        cache = {}
+        resolver = ImageResolver([directory], cache)
+        warm_up(document('<para>Text</para>',
+                         '<image file="a.png" x="0" y="0" width="10"/>'),
+                image_resolver=resolver.resolve_image, render=True)
+        self.assertEqual(len(cache), 1)
+
+
+class TableTest(unittest.TestCase):
+    """Tables of plain and deferred cells, and of columns sized from their
+    rows.
+    """
+
+    def test_page_count_cell(self):
+        for widths in (' colWidths="200,100"', ''):
+            story = ('<blockTable%s><tr><td><para>Total <pageCount/></para>'
+                     '</td><td>1.50</td></tr></blockTable>' %(widths))
+            drawn = strings(render(document(story)))
+            self.assertTrue('Total 1' in drawn, widths)
+            self.assertTrue('1.50' in drawn, widths)
+
+    def auto_table(self, rows, attrs=' splitByRow="1"', styles=''):
+        return document('<blockTable colWidths="auto"%s>%s</blockTable>'
+                        %(attrs, ''.join(['<tr><td>%s</td><td>%s</td></tr>'
+                                          %(row) for row in rows])),
+                        styles=styles)
+
+    def test_auto_sample(self):
+        narrow = offsets(render(self.auto_table([('a', 'b')]*60)))['b']
+        rows = [('a', 'b')]*60
+        rows[55] = ('a'*40, 'b')
+        wide = offsets(render(self.auto_table(rows)))['b']
+        self.assertEqual(len(wide), 1)
+        self.assertTrue(min(wide)>max(narrow)+100)
+
+    def test_auto_span(self):
+        styles = ('<blockTableStyle id="span"><blockSpan start="0,0" '
+                  'stop="1,0"/></blockTableStyle>')
+        rows = [('A header spanning both columns', '')]+[('a', 'b')]*3
+        spanned = render(self.auto_table(rows, ' style="span"', styles))
+        narrow = render(self.auto_table([('a', 'b')]*3))
+        self.assertEqual(offsets(spanned)['b'], offsets(narrow)['b'])
+
+    def test_auto_plain_cells(self):
+        words = ' '.join(['word%d' %(i) for i in range(120)])
+        drawn = strings(render(self.auto_table(
+            [('<para>short</para>', '<para>%s</para>' %(words))], '')))
+        self.assertEqual(drawn[0], 'short')
+        self.assertTrue(len(drawn)>2)
+        self.assertEqual(' '.join(drawn[1:]).split(), words.split())
+
+    def test_auto_split(self):
+        rows = [('a%d' %(i), 'b') for i in range(150)]
+        rows[120] = ('a'*40, 'b')
+        pdf = render(self.auto_table(rows))
+        self.assertTrue(page_count(pdf)>2)
+        self.assertEqual(len(offsets(pdf)['b']), 1)
+
+
+class RangeTest(unittest.TestCase):
+    """Ranges of several responses of one entity tag make up one PDF.
+    """
+
+    def test_ranges(self):
+        rml = document('<para>Text</para>', PAGE_FOOTER)
+        etag = rml_etag(rml)
+        render = lambda: rml2pdf(rml, deterministic=etag)
+        head = respond(etag, None, 'bytes=0-99', render)[1]
+        time.sleep(1.1)
+        status, tail, headers = respond(etag, None, 'bytes=100-', render)
+        self.assertEqual(status, 206)
+        self.assertEqual(head+tail, render())
+
+    def test_missing_file(self):
+        rml = document('<image file="missing.png" width="10"/>')
+        self.assertEqual(rml_etag(rml, ['/nonexistent']), rml_etag(rml))
+
+
+class CanvasTest(unittest.TestCase):
+    """Canvas documents of several <pageDrawing> elements.
+    """
+    drawing = ('<pageDrawing><place x="72" y="72" width="400" height="200">'
+               '<para style="big">Styled</para></place>%s</pageDrawing>'
+               %(PAGE_FOOTER))
+
+    stylesheet = ('<stylesheet><paraStyle name="big" fontName="Courier" '
+                  'fontSize="30"/></stylesheet>')
+
+    def test_streamed(self):
+        rml = '<document filename="c.pdf">%s%s</document>' %(
+            self.stylesheet, self.drawing*30)
+        for profile in ('fast', 'default'):
+            pdf = rml2pdf(rml, profile=profile)
+            self.assertEqual(page_count(pdf), 30)
+            # objects are where the cross-reference table tells
+            start = int(re.search(r'startxref\n(\d+)', pdf).group(1))
+            offsets = re.findall(r'(\d{10}) 00000 n ', pdf[start:])
+            for number, offset in enumerate(offsets):
+                self.assertTrue(pdf[int(offset):].startswith(
+                    '%d 0 obj' %(number+1)), profile)
+        self.assertTrue('Page 30 of 30' in strings(render(rml)))
+
+    def test_late_stylesheet(self):
+        pdf = render('<document filename="c.pdf">%s%s</document>' %(
+            self.drawing*2, self.stylesheet))
+        self.assertEqual(pdf.count('30 Tf'), 2)
+
+    def test_page_count(self):
+        # only elements count, not text looking like them
+        rml = ('<document filename="c.pdf">%s<!-- <pageDrawing> -->%s'
+               '<pageDrawing><drawString x="0" y="0"><![CDATA[<pageDrawing>]]>'
+               '</drawString></pageDrawing></document>'
+               %(self.stylesheet, self.drawing*2))
+        self.assertEqual(trml2pdf._rml_doc(rml).drawing_count, 3)
+        self.assertTrue('Page 2 of 3' in strings(render(rml)))
+
+    def test_late_elements(self):
+        rml = '<document filename="c.pdf">%s%s%s</document>' %(
+            self.drawing, self.stylesheet, self.drawing)
+        self.assertEqual(trml2pdf._rml_doc(rml).drawings, None)
+        drawings = trml2pdf._parse_drawings(rml)[1]
+        drawings.next()
+        self.assertRaises(ValueError, drawings.next)
+        pdf = render(rml)
+        self.assertEqual((page_count(pdf), pdf.count('30 Tf')), (2, 2))
+
+
+class SplitTest(unittest.TestCase):
+    """Output split into files, written as the story is laid out.
+    """
+
+    def setUp(self):
+        self.flowable = trml2pdf._rml_flowable._flowable
+
+    def tearDown(self):
+        trml2pdf._rml_flowable._flowable = self.flowable
+
+    def test_parts(self):
+        directory = tempfile.mkdtemp()
+        pattern = os.path.join(directory, 'part-%d.pdf')
+        # parts written when each flowable is built
+        written = []
+        def flowable(self_, node):
+            written.append(len(os.listdir(directory)))
+            return self.flowable(self_, node)
+        trml2pdf._rml_flowable._flowable = flowable
+        story = '\n'.join(['<para>Line %d</para>' %(i) for i in range(150)])
+        footer = '<drawString x="40" y="20">Page <pageNumber/></drawString>'
+        filenames = rml2pdf_split(document(story, footer), pattern,
+                                  max_pages=2, profile='fast')
+        self.assertEqual(filenames, [pattern %(i) for i in (1, 2)])
+        pdfs = [open(filename, 'rb').read() for filename in filenames]
+        self.assertEqual([page_count(pdf) for pdf in pdfs], [2, 1])
+        self.assertTrue('Page 3' in strings(pdfs[1]))
+        self.assertEqual((written[0], written[-1]), (0, 1))
+
+
+class ProfileTest(unittest.TestCase):
+    """Output profiles apply to their own document only.
+    """
+
+    def test_threads(self):
+        rml = document('\n'.join(['<para>Line %d</para>' %(i)
+                                   for i in range(200)]), PAGE_FOOTER)
+        names = ['fast', 'default'] * 4
+        expected = dict([(name, rml2pdf(rml, profile=name,
+                                         deterministic=True))
+                         for name in names])
+        results = []
+        def render(name):
+            results.append(
+                (name, rml2pdf(rml, profile=name, deterministic=True)))
+        threads = [threading.Thread(target=render, args=(name,))
+                   for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), len(names))
+        for name, pdf in results:
+            self.assertEqual(pdf, expected[name], name)
+        self.assertTrue(len(expected['fast'])>len(expected['default']))
+
+
+suite = unittest.TestSuite()
+suite.addTests(unittest.makeSuite(DrawingTest))
+suite.addTests(unittest.makeSuite(BoundTableTest))
+suite.addTests(unittest.makeSuite(PageCountTest))
+suite.addTests(unittest.makeSuite(PreviewTest))
+suite.addTests(unittest.makeSuite(StaticTest))
+suite.addTests(unittest.makeSuite(RecordsTest))
+suite.addTests(unittest.makeSuite(LabelTest))
+suite.addTests(unittest.makeSuite(BarcodeTest))
+suite.addTests(unittest.makeSuite(ChartTest))
+suite.addTests(unittest.makeSuite(ImageResolverTest))
+suite.addTests(unittest.makeSuite(WarmUpTest))
+suite.addTests(unittest.makeSuite(TableTest))
+suite.addTests(unittest.makeSuite(RangeTest))
+suite.addTests(unittest.makeSuite(CanvasTest))
+suite.addTests(unittest.makeSuite(SplitTest))
+suite.addTests(unittest.makeSuite(ProfileTest))